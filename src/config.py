@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -8,6 +8,135 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     COMET_API_KEY: str
 
+    # HTTP-клиент провайдера генерации (один на процесс)
+    PROVIDER_HTTP_LIMIT: int = 100
+    PROVIDER_HTTP_LIMIT_PER_HOST: int = 16
+    PROVIDER_DNS_CACHE_TTL: int = 300
+    PROVIDER_KEEPALIVE_TIMEOUT: float = 60.0
+    # Прогрев соединений при старте бота
+    PROVIDER_WARMUP: bool = False
+    PROVIDER_WARMUP_CONNECTIONS: int = 2
+    # Максимальный размер ответа провайдера (4K PNG в base64 весит десятки МБ)
+    PROVIDER_MAX_RESPONSE_BYTES: int = 64 * 1024 * 1024
+
+    # Сколько фото из Telegram качаем одновременно (на весь процесс)
+    TELEGRAM_DOWNLOAD_CONCURRENCY: int = 8
+
+    # Кеш скачанных селфи (по file_unique_id) и ссылок get_file (живут у Telegram минимум час)
+    INPUT_PHOTO_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    INPUT_FILE_PATH_TTL_SECONDS: int = 50 * 60
+    INPUT_FILE_PATH_CACHE_SIZE: int = 10000
+
+    # Пул потоков для base64/записи файлов; работа меньше порога выполняется прямо в loop
+    CODEC_THREADS: int = 4
+    CODEC_OFFLOAD_THRESHOLD_BYTES: int = 256 * 1024
+
+    # Предобработка селфи перед отправкой провайдеру (в пуле процессов)
+    PREPROCESS_ENABLED: bool = True
+    PREPROCESS_MAX_EDGE: int = 1536
+    PREPROCESS_JPEG_QUALITY: int = 90
+    PREPROCESS_WORKERS: int = 2
+
+    # Хранилище результатов: каталог (по умолчанию <проект>/outputs) и лимит на диске
+    OUTPUT_STORE_DIR: str = ""
+    OUTPUT_STORE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+
+    # Сколько file_id (уже загруженных в Telegram файлов) помним для повторных отправок
+    FILE_ID_CACHE_SIZE: int = 10000
+
+    # Кеш результатов генерации (тот же промпт/модель/размер/фото): срок жизни и число записей
+    RESULT_CACHE_TTL_SECONDS: float = 24 * 3600
+    RESULT_CACHE_MAX_ENTRIES: int = 5000
+
+    # Новое селфи, пока у пользователя идёт генерация: "replace" — встать в очередь
+    # (ждущую заявку заменяет более новая), "reject" — отказать
+    USER_GENERATION_POLICY: str = "replace"
+
+    # Провайдер генерации по умолчанию (см. src/services/providers.py): "apiyi", "comet", "kitay"
+    GENERATION_PROVIDER: str = "apiyi"
+
+    # Хеджирование: если провайдер не ответил за перцентиль недавних задержек,
+    # параллельно спрашиваем запасной (пусто — выключено). Ключ пустой — ключ самого провайдера.
+    # Пока задержек меньше MIN_SAMPLES, ждём DEFAULT_DELAY; дополнительных запросов — не больше BUDGET_PERCENT %
+    GENERATION_HEDGE_PROVIDER: str = ""
+    GENERATION_HEDGE_API_KEY: str = ""
+    GENERATION_HEDGE_PERCENTILE: float = 0.9
+    GENERATION_HEDGE_MIN_SAMPLES: int = 20
+    GENERATION_HEDGE_DEFAULT_DELAY_SECONDS: float = 60
+    GENERATION_HEDGE_BUDGET_PERCENT: float = 10
+
+    # Автомат провайдера: после стольких сбоев подряд перестаём слать запросы на OPEN_SECONDS,
+    # затем пробуем одним запросом. Пока автомат разомкнут — запасной провайдер (пусто — сразу ошибка)
+    PROVIDER_BREAKER_FAILURE_THRESHOLD: int = 5
+    PROVIDER_BREAKER_OPEN_SECONDS: float = 30
+    GENERATION_FALLBACK_PROVIDER: str = ""
+    # AIMD-лимит одновременных запросов к одному провайдеру: растёт, пока ответы быстрее
+    # LATENCY_TARGET, и делится пополам на 429/таймаутах
+    PROVIDER_CONCURRENCY_INITIAL: int = 4
+    PROVIDER_CONCURRENCY_MIN: int = 1
+    PROVIDER_CONCURRENCY_MAX: int = 16
+    PROVIDER_CONCURRENCY_LATENCY_TARGET_SECONDS: float = 90
+
+    # Повторы временных ошибок провайдера (429, обрыв, таймаут, 5xx, битый ответ):
+    # сколько всего попыток, экспоненциальная задержка с джиттером (база/потолок).
+    # Новую попытку не начинаем, если до дедлайна задачи осталось меньше задержки + MIN_ATTEMPT
+    GENERATION_RETRY_MAX_ATTEMPTS: int = 3
+    GENERATION_RETRY_BASE_DELAY_SECONDS: float = 1
+    GENERATION_RETRY_MAX_DELAY_SECONDS: float = 20
+    GENERATION_RETRY_MIN_ATTEMPT_SECONDS: float = 20
+
+    # Пул API-ключей провайдера: дополнительные ключи (JSON в .env: {"apiyi": ["sk-...", ...]}),
+    # на каждый ключ — лимит одновременных запросов и запросов в секунду (0 — без лимита),
+    # после 401/403/429 ключ отдыхает столько секунд (или сколько сказал Retry-After)
+    PROVIDER_API_KEYS: Dict[str, List[str]] = {}
+    PROVIDER_KEY_MAX_CONCURRENCY: int = 4
+    PROVIDER_KEY_RPS: float = 2
+    PROVIDER_KEY_COOLDOWN_SECONDS: float = 60
+
+    # Сколько кандидатов (generationConfig.candidateCount) провайдер отдаёт за один запрос
+    # (JSON в .env: {"apiyi": 4}); не указан — 1, candidateCount не передаём
+    PROVIDER_MAX_CANDIDATES: Dict[str, int] = {}
+
+    # Размер результата под нагрузкой: 4K, пока ETA очереди и p95 задержки провайдера ниже порогов;
+    # выше порогов 2K — 2K, выше порогов 1K — 1K (0 — порог не учитывать).
+    # Назад к 4K — когда нагрузка ниже порога × RECOVER_RATIO
+    GENERATION_ADAPTIVE_SIZE: bool = True
+    GENERATION_SIZE_2K_ETA_SECONDS: float = 120
+    GENERATION_SIZE_1K_ETA_SECONDS: float = 240
+    GENERATION_SIZE_2K_P95_SECONDS: float = 90
+    GENERATION_SIZE_1K_P95_SECONDS: float = 180
+    GENERATION_SIZE_RECOVER_RATIO: float = 0.7
+
+    # Двухфазная выдача: сначала быстрое превью 1K, затем финальное фото —
+    # "edit" (заменяет превью в том же сообщении), "document" (отдельным файлом без сжатия), "" — выключено
+    GENERATION_PROGRESSIVE_DELIVERY: str = ""
+
+    # Подборка: сколько стилей можно выбрать для одного селфи (результат — одним альбомом)
+    GENERATION_MULTI_STYLE_MAX: int = 4
+
+    # «Другой вариант в этом стиле»: сколько вариантов просить одним запросом (альбомом;
+    # не больше, чем разрешено в PROVIDER_MAX_CANDIDATES; 1 — как обычно, одно фото)
+    GENERATION_VARIANT_CANDIDATES: int = 1
+
+    # Планировщик генераций: число воркеров, сколько заявок может ждать, лимит на одну задачу
+    GENERATION_WORKERS: int = 4
+    GENERATION_QUEUE_MAX: int = 100
+    GENERATION_JOB_TIMEOUT_SECONDS: float = 420
+    # Сколько раз задачу можно начинать заново (после перезапусков), прежде чем сдаться
+    GENERATION_JOB_MAX_ATTEMPTS: int = 3
+    # Веса уровней в справедливой очереди (JSON в .env): чем больше вес, тем чаще запуск
+    GENERATION_TIER_WEIGHTS: Dict[str, float] = {
+        "admin": 8.0,
+        "credits": 4.0,
+        "balance": 2.0,
+        "free": 1.0,
+    }
+    # Допуск: не принимаем заявку, если ожидаемое время готовности больше (0 — не ограничиваем);
+    # пока замеров генераций меньше GENERATION_MIN_JOB_SAMPLES, одна генерация считается такой длительности
+    GENERATION_ADMISSION_MAX_ETA_SECONDS: float = 300
+    GENERATION_DEFAULT_JOB_SECONDS: float = 30
+    GENERATION_MIN_JOB_SAMPLES: int = 5
+
     # .env ищем в корне проекта, откуда ты запускаешь `python src/main.py`
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -15,6 +15,7 @@ from sqlalchemy import (
     Integer,
     DateTime,
     Enum,
+    UniqueConstraint,
     func,
     select,
 )
@@ -26,7 +27,7 @@ from sqlalchemy.ext.asyncio import (
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column
 
 from src.data.star_offers import StarOffer
-from config import settings
+from src.config import settings
 SUPER_ADMIN_ID = 707366569
 
 engine = create_async_engine(
@@ -652,3 +653,191 @@ async def get_style_by_offset(offset: int) -> StylePrompt | None:
         )
         style = result.scalar_one_or_none()
         return style
+
+
+# ---------- Задачи генерации (переживают перезапуск) ----------
+
+class GenerationJobStatus(str, enum.Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"  # картинка готова и лежит в хранилище, но ещё не доставлена
+    failed = "failed"
+    delivered = "delivered"
+
+
+class GenerationJob(Base):
+    """
+    Заявка на фотосессию. Пишется до постановки в очередь, чтобы после перезапуска
+    продолжить её (без повторного списания) или доставить уже готовый результат.
+    """
+
+    __tablename__ = "generation_jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    telegram_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger)
+
+    # стиль: id из style_prompts и снимок названия/промпта на момент заявки
+    style_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    style_title: Mapped[str] = mapped_column(String(128))
+    style_prompt: Mapped[str | None] = mapped_column(String(2048), nullable=True)
+
+    # входные фото: file_id / file_unique_id через пробел
+    file_ids: Mapped[str] = mapped_column(String(1024))
+    file_unique_ids: Mapped[str] = mapped_column(String(512), default="")
+    force_regenerate: Mapped[bool] = mapped_column(Boolean, default=False)
+    progress_message_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+
+    # размер результата, который запросили (под нагрузкой может быть меньше 4K)
+    image_size: Mapped[str | None] = mapped_column(String(8), nullable=True)
+
+    status: Mapped[GenerationJobStatus] = mapped_column(
+        Enum(GenerationJobStatus),
+        default=GenerationJobStatus.queued,
+        index=True,
+    )
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    charged: Mapped[bool] = mapped_column(Boolean, default=False)
+
+    # sha256 готовой картинки в хранилище результатов
+    result_digest: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    error_message: Mapped[str | None] = mapped_column(String(512), nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
+
+
+async def create_generation_job(
+    telegram_id: int,
+    chat_id: int,
+    style_title: str,
+    style_prompt: str | None,
+    file_ids: List[str],
+    file_unique_ids: List[str],
+    style_id: int | None = None,
+    force_regenerate: bool = False,
+    progress_message_id: int | None = None,
+) -> GenerationJob:
+    async with async_session() as session:
+        job = GenerationJob(
+            telegram_id=telegram_id,
+            chat_id=chat_id,
+            style_id=style_id,
+            style_title=style_title,
+            style_prompt=style_prompt,
+            file_ids=" ".join(file_ids),
+            file_unique_ids=" ".join(file_unique_ids),
+            force_regenerate=force_regenerate,
+            progress_message_id=progress_message_id,
+            status=GenerationJobStatus.queued,
+        )
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+        return job
+
+
+async def update_generation_job(job_id: int, **fields) -> None:
+    """
+    Обновляет поля задачи (status, charged, result_digest, error_message, ...).
+    """
+    if "error_message" in fields and fields["error_message"]:
+        fields["error_message"] = fields["error_message"][:512]
+
+    async with async_session() as session:
+        job = await session.get(GenerationJob, job_id)
+        if job is None:
+            return
+        for name, value in fields.items():
+            setattr(job, name, value)
+        await session.commit()
+
+
+async def start_generation_job_attempt(job_id: int) -> int:
+    """
+    Отмечает задачу как выполняемую и возвращает номер попытки.
+    """
+    async with async_session() as session:
+        job = await session.get(GenerationJob, job_id)
+        if job is None:
+            return 0
+        job.status = GenerationJobStatus.running
+        job.attempts += 1
+        await session.commit()
+        return job.attempts
+
+
+async def get_unfinished_generation_jobs() -> List[GenerationJob]:
+    """
+    Задачи, оборванные перезапуском: в очереди, в работе, либо готовые, но не доставленные.
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(GenerationJob)
+            .where(
+                GenerationJob.status.in_(
+                    [
+                        GenerationJobStatus.queued,
+                        GenerationJobStatus.running,
+                        GenerationJobStatus.succeeded,
+                    ]
+                )
+            )
+            .order_by(GenerationJob.id.asc())
+        )
+        return list(result.scalars().all())
+
+
+# ---------- API-ключи провайдеров (меняются из админки без перезапуска) ----------
+
+class ProviderApiKey(Base):
+    """
+    Ключ провайдера, добавленный или убранный через админку.
+    is_active=False — ключ выведен из ротации (в том числе ключ из настроек .env).
+    """
+
+    __tablename__ = "provider_api_keys"
+    __table_args__ = (UniqueConstraint("provider", "api_key", name="uq_provider_api_key"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    provider: Mapped[str] = mapped_column(String(32), index=True)
+    api_key: Mapped[str] = mapped_column(String(256))
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
+
+
+async def get_provider_api_keys() -> List[ProviderApiKey]:
+    async with async_session() as session:
+        result = await session.execute(select(ProviderApiKey).order_by(ProviderApiKey.id.asc()))
+        return list(result.scalars().all())
+
+
+async def set_provider_api_key_active(provider: str, api_key: str, is_active: bool) -> None:
+    """
+    Добавляет ключ (is_active=True) или выводит его из ротации (is_active=False).
+    """
+    async with async_session() as session:
+        row = await session.scalar(
+            select(ProviderApiKey).where(
+                ProviderApiKey.provider == provider,
+                ProviderApiKey.api_key == api_key,
+            )
+        )
+        if row is None:
+            row = ProviderApiKey(provider=provider, api_key=api_key, is_active=is_active)
+            session.add(row)
+        else:
+            row.is_active = is_active
+        await session.commit()
@@ -24,6 +24,7 @@ from src.db import (
 get_admin_users,
 
 )
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 
 from src.services.admins import (
@@ -33,6 +34,26 @@ from src.services.admins import (
     get_admin_ids,
 )
 from src.db import SUPER_ADMIN_ID
+from src.config import settings
+from src.services.key_pool import (
+    add_api_key,
+    get_key_pool,
+    mask_key,
+    remove_api_key,
+    replace_api_key,
+)
+from src.services.circuit_breaker import gate_stats
+from src.services.delivery import file_id_cache
+from src.services.generation_jobs import generation_scheduler
+from src.services.hedging import generation_hedger
+from src.services.input_cache import input_photo_cache
+from src.services.output_store import get_output_store
+from src.services.photoshoot import generation_flights
+from src.services.providers import provider_stats
+from src.services.quality import quality_controller
+from src.services.result_cache import result_cache
+from src.services.retry import generation_retry
+from src.services.user_guard import user_generation_guard
 
 
 router = Router()
@@ -74,6 +95,12 @@ def get_admin_main_keyboard() -> InlineKeyboardMarkup:
                     callback_data="admin_change_api_key",
                 )
             ],
+            [
+                InlineKeyboardButton(
+                    text="⚙️ Нагрузка генерации",
+                    callback_data="admin_load",
+                )
+            ],
             [
                 InlineKeyboardButton(
                     text="⬅️ Выйти из админ-панели",
@@ -464,6 +491,143 @@ async def admin_report_7d(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
+# ---------- нагрузка генерации (очередь, провайдеры, кеши) ----------
+
+def _format_counters(counters: dict) -> str:
+    return ", ".join(f"{name}={value}" for name, value in counters.items())
+
+
+def format_load_stats() -> str:
+    lines = ["⚙️ Нагрузка генерации\n", f"<b>Очередь:</b> {_format_counters(generation_scheduler.stats)}"]
+    for tier, counters in generation_scheduler.tier_stats.items():
+        lines.append(f"• {tier}: {_format_counters(counters)}")
+    lines.append(f"<b>Пользователи:</b> {_format_counters(user_generation_guard.stats)}")
+    lines.append(f"<b>Размер результата:</b> {_format_counters(quality_controller.stats)}")
+
+    lines.append("\n<b>Провайдеры:</b>")
+    for name, counters in provider_stats().items():
+        lines.append(f"• {name}: {_format_counters(counters)}")
+    for name, gates in gate_stats().items():
+        lines.append(f"• {name} автомат: {_format_counters(gates['breaker'])}")
+        lines.append(f"• {name} параллельность: {_format_counters(gates['concurrency'])}")
+    lines.append(f"• повторы: {_format_counters(generation_retry.stats)}")
+    lines.append(f"• хеджирование: {_format_counters(generation_hedger.stats)}")
+    lines.append(f"• склейка одинаковых: {_format_counters(generation_flights.stats)}")
+
+    lines.append("\n<b>Кеши:</b>")
+    lines.append(f"• результаты: {_format_counters(result_cache.stats)}")
+    lines.append(f"• хранилище: {_format_counters(get_output_store().stats)}")
+    lines.append(f"• входные фото: {_format_counters(input_photo_cache.stats)}")
+    lines.append(f"• file_id отправленных: {_format_counters(file_id_cache.stats)}")
+    return "\n".join(lines)
+
+
+@router.callback_query(F.data == "admin_load")
+async def admin_load(callback: CallbackQuery, state: FSMContext):
+    if not await is_admin(callback.from_user.id):
+        await callback.answer()
+        return
+
+    try:
+        await callback.message.edit_text(
+            format_load_stats(),
+            reply_markup=InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_load")],
+                    [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_menu")],
+                ]
+            ),
+        )
+    except TelegramBadRequest:
+        # «message is not modified» — цифры не изменились с прошлого нажатия
+        pass
+    await callback.answer()
+
+
+# ---------- API-ключи провайдера (пул, меняется без перезапуска) ----------
+
+def format_api_keys() -> str:
+    provider_name = settings.GENERATION_PROVIDER
+    pool = get_key_pool(provider_name)
+
+    lines = [f"🔐 Ключи провайдера {provider_name}:\n"]
+    if not pool.has_keys():
+        lines.append("— ключей нет, генерация не работает")
+    for i, info in enumerate(pool.stats, start=1):
+        line = (
+            f"{i}. <code>{info['key']}</code> — запросов: {info['requests']}, "
+            f"ошибок: {info['errors']}, сейчас: {info['in_flight']}"
+        )
+        if info["cooldown_seconds"]:
+            line += f", отдыхает {info['cooldown_seconds']:.0f} с ({info['last_error_class']})"
+        lines.append(line)
+
+    lines.append(
+        "\nОтправь сообщение:\n"
+        "• <code>+ КЛЮЧ</code> — добавить ключ\n"
+        "• <code>- НОМЕР</code> — убрать ключ\n"
+        "• <code>НОМЕР КЛЮЧ</code> — заменить ключ\n\n"
+        "Изменения применяются сразу, без перезапуска."
+    )
+    return "\n".join(lines)
+
+
+@router.callback_query(F.data == "admin_change_api_key")
+async def admin_change_api_key(callback: CallbackQuery, state: FSMContext):
+    if not await is_admin(callback.from_user.id):
+        await callback.answer()
+        return
+
+    await state.set_state(AdminStates.change_api_key)
+
+    await callback.message.edit_text(
+        format_api_keys(),
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_menu")]]
+        ),
+    )
+    await callback.answer()
+
+
+@router.message(AdminStates.change_api_key)
+async def admin_change_api_key_input(message: Message, state: FSMContext):
+    if not await is_admin(message.from_user.id):
+        return
+
+    text = (message.text or "").strip()
+
+    # в сообщении секрет — не оставляем его в переписке
+    try:
+        await message.delete()
+    except Exception:
+        pass
+
+    provider_name = settings.GENERATION_PROVIDER
+    keys = get_key_pool(provider_name).keys
+    parts = text.split()
+
+    if len(parts) == 2 and parts[0] == "+":
+        await add_api_key(provider_name, parts[1])
+        result = f"✅ Ключ <code>{mask_key(parts[1])}</code> добавлен."
+    elif len(parts) == 2 and parts[0] == "-" and parts[1].isdigit() and 1 <= int(parts[1]) <= len(keys):
+        old_key = keys[int(parts[1]) - 1]
+        await remove_api_key(provider_name, old_key)
+        result = f"✅ Ключ <code>{mask_key(old_key)}</code> убран."
+    elif len(parts) == 2 and parts[0].isdigit() and 1 <= int(parts[0]) <= len(keys):
+        old_key = keys[int(parts[0]) - 1]
+        await replace_api_key(provider_name, old_key, parts[1])
+        result = f"✅ Ключ <code>{mask_key(old_key)}</code> заменён на <code>{mask_key(parts[1])}</code>."
+    else:
+        result = "Не понял команду. Номер ключа смотри в списке ниже."
+
+    await message.answer(
+        result + "\n\n" + format_api_keys(),
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_menu")]]
+        ),
+    )
+
+
 @router.callback_query(F.data == "admin_style_add")
 async def admin_style_add_start(callback: CallbackQuery, state: FSMContext):
     if not await is_admin(callback.from_user.id):
@@ -8,7 +8,9 @@ from aiogram.types import (
     CallbackQuery,
     FSInputFile,
     InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup,
+    PhotoSize,
 )
+from src.config import settings
 from src.paths import IMG_DIR
 from src.states import MainStates
 from src.data.styles import styles, PHOTOSHOOT_PRICE
@@ -19,9 +21,22 @@ from src.keyboards import (
     get_back_to_album_keyboard,
     get_start_keyboard,
 )
-from src.db import log_photoshoot, PhotoshootStatus
-from src.services.photoshoot import generate_photoshoot_image
-from src.db import consume_photoshoot_credit_or_balance
+from src.services.photoshoot import find_cached_photoshoot, photo_caption
+from src.services.generation_jobs import (
+    PhotoshootBatch,
+    PhotoshootJob,
+    enqueue_photoshoot_batch,
+    enqueue_photoshoot_job,
+    format_eta,
+)
+from src.services.scheduler import Admission, QueueFull
+from src.services.user_guard import POLICY_REPLACE, user_generation_guard
+from src.services.delivery import (
+    edit_photo_cached,
+    send_output_photo,
+    send_photo_cached,
+    style_image_key,
+)
 from src.db import (get_style_by_offset,
     count_active_styles,)
 from src.data.styles import PHOTOSHOOT_PRICE
@@ -29,6 +44,17 @@ from src.data.styles import PHOTOSHOOT_PRICE
 router = Router()
 
 
+def _styles_keyboard(data: dict, style_id: int | None) -> InlineKeyboardMarkup:
+    """
+    Клавиатура карусели с учётом подборки (selected_styles в FSM).
+    """
+    selected = data.get("selected_styles") or []
+    return get_styles_keyboard(
+        in_selection=any(item["id"] == style_id for item in selected),
+        selected_count=len(selected),
+    )
+
+
 @router.message(F.text == "Перейти к альбому 📖")
 async def get_album(message: Message, state: FSMContext):
     await state.set_state(MainStates.making_photoshoot)
@@ -50,10 +76,13 @@ async def get_album(message: Message, state: FSMContext):
 
     await state.update_data(current_style_index=current_index)
 
-    inline_keyboard_markup = get_styles_keyboard()
+    inline_keyboard_markup = _styles_keyboard(await state.get_data(), style.id)
 
-    await message.answer_photo(
-        photo=FSInputFile(str(IMG_DIR / style.image_filename)),
+    await send_photo_cached(
+        message.bot,
+        message.chat.id,
+        style_image_key(style.image_filename),
+        FSInputFile(str(IMG_DIR / style.image_filename)),
         caption=f"<b>{style.title}</b>\n\n<i>{style.description}</i>",
         reply_markup=inline_keyboard_markup,
     )
@@ -83,14 +112,14 @@ async def next_style(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Не удалось загрузить стиль.")
         return
 
-    inline_keyboard_markup = get_styles_keyboard()
+    inline_keyboard_markup = _styles_keyboard(data, style.id)
 
     try:
-        await callback.message.edit_media(
-            media=InputMediaPhoto(
-                media=FSInputFile(str(IMG_DIR / style.image_filename)),
-                caption=f"<b>{style.title}</b>\n\n<i>{style.description}</i>",
-            ),
+        await edit_photo_cached(
+            callback.message,
+            style_image_key(style.image_filename),
+            FSInputFile(str(IMG_DIR / style.image_filename)),
+            caption=f"<b>{style.title}</b>\n\n<i>{style.description}</i>",
             reply_markup=inline_keyboard_markup,
         )
     except TelegramBadRequest as e:
@@ -127,14 +156,14 @@ async def previous_style(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Не удалось загрузить стиль.")
         return
 
-    inline_keyboard_markup = get_styles_keyboard()
+    inline_keyboard_markup = _styles_keyboard(data, style.id)
 
     try:
-        await callback.message.edit_media(
-            media=InputMediaPhoto(
-                media=FSInputFile(str(IMG_DIR / style.image_filename)),
-                caption=f"<b>{style.title}</b>\n\n<i>{style.description}</i>",
-            ),
+        await edit_photo_cached(
+            callback.message,
+            style_image_key(style.image_filename),
+            FSInputFile(str(IMG_DIR / style.image_filename)),
+            caption=f"<b>{style.title}</b>\n\n<i>{style.description}</i>",
             reply_markup=inline_keyboard_markup,
         )
     except TelegramBadRequest as e:
@@ -160,8 +189,10 @@ async def make_photoshoot(callback: CallbackQuery, state: FSMContext):
 
     await state.update_data(
         current_style_index=current_index,
+        current_style_id=style.id,
         current_style_title=style.title,
         current_style_prompt=style.prompt,
+        multi_styles=None,
     )
     await state.set_state(MainStates.making_photoshoot_process)
 
@@ -183,6 +214,70 @@ async def make_photoshoot(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer(text, reply_markup=inline_keyboard_markup)
 
 
+@router.callback_query(F.data == "toggle_multi_style")
+async def toggle_multi_style(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    style = await get_style_by_offset(data.get("current_style_index", 0))
+    if style is None:
+        await callback.answer("Не удалось загрузить стиль.")
+        return
+
+    selected = list(data.get("selected_styles") or [])
+    if any(item["id"] == style.id for item in selected):
+        selected = [item for item in selected if item["id"] != style.id]
+        note = "Убрал из подборки"
+    elif len(selected) >= settings.GENERATION_MULTI_STYLE_MAX:
+        await callback.answer(
+            f"В подборке может быть не больше {settings.GENERATION_MULTI_STYLE_MAX} стилей",
+            show_alert=True,
+        )
+        return
+    else:
+        selected.append({"id": style.id, "title": style.title, "prompt": style.prompt})
+        note = "Добавил в подборку ✅"
+
+    await state.update_data(selected_styles=selected)
+    data["selected_styles"] = selected
+
+    try:
+        await callback.message.edit_reply_markup(reply_markup=_styles_keyboard(data, style.id))
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+
+    await callback.answer(note)
+
+
+@router.callback_query(F.data == "make_multi_photoshoot")
+async def make_multi_photoshoot(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    selected = data.get("selected_styles") or []
+    if not selected:
+        await callback.answer("Подборка пуста — добавь стили кнопкой «➕ В подборку».")
+        return
+
+    await state.update_data(multi_styles=selected, selected_styles=[])
+    await state.set_state(MainStates.making_photoshoot_process)
+
+    back_inline_button = InlineKeyboardButton(text="Назад", callback_data="next")
+    inline_keyboard_markup = InlineKeyboardMarkup(
+        inline_keyboard=[[back_inline_button]]
+    )
+
+    titles = ", ".join(f"«{item['title']}»" for item in selected)
+    text = (
+        f"Отлично! В подборке стилей: {len(selected)} — {titles}\n"
+        f"Каждый стиль — отдельная фотосессия ({PHOTOSHOOT_PRICE} ₽ или оплаченный слот).\n\n"
+        "Теперь пришли своё селфи — сделаю все стили сразу и пришлю одним альбомом:\n"
+        "— лицо прямо,\n"
+        "— хорошее освещение,\n"
+        "— без фильтров и очков."
+    )
+
+    await callback.answer()
+    await callback.message.answer(text, reply_markup=inline_keyboard_markup)
+
+
 @router.callback_query(F.data == "back_to_album")
 async def back_to_album(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
@@ -194,8 +289,11 @@ async def back_to_album(callback: CallbackQuery, state: FSMContext):
     await state.set_state(MainStates.making_photoshoot)
 
     await callback.answer()
-    await callback.message.answer_photo(
-        photo=FSInputFile(str(IMG_DIR / style["img"])),
+    await send_photo_cached(
+        callback.bot,
+        callback.message.chat.id,
+        style_image_key(style["img"]),
+        FSInputFile(str(IMG_DIR / style["img"])),
         caption=f"<b>{style['title']}</b>\n\n<i>{style['description']}</i>",
         reply_markup=inline_keyboard_markup,
     )
@@ -209,104 +307,143 @@ async def handle_selfie(message: Message, state: FSMContext):
 
     user_photo = message.photo[-1]
     user_photo_file_id = user_photo.file_id
+    user_photo_file_unique_id = user_photo.file_unique_id
 
-    await state.update_data(user_photo_file_id=user_photo_file_id)
+    # «Другой вариант» — генерируем заново, даже если такой результат уже есть в кеше
+    force_regenerate = bool(data.get("force_regenerate"))
 
-    # списание кредита/баланса как раньше
-    can_pay = await consume_photoshoot_credit_or_balance(
-        telegram_id=message.from_user.id,
-        price_rub=PHOTOSHOOT_PRICE,
+    await state.update_data(
+        user_photo_file_id=user_photo_file_id,
+        user_photo_file_unique_id=user_photo_file_unique_id,
+        force_regenerate=False,
     )
 
-    if False:
-        await state.set_state(MainStates.making_photoshoot_failed)
-        text = (
-            "Недостаточно средств для создания фотосессии.\n"
-            f"Стоимость одной фотосессии — <b>{PHOTOSHOOT_PRICE} ₽</b> "
-            "или заранее оплаченный слот через Stars.\n\n"
-            "Пополнить баланс прямо сейчас?"
-        )
-        await message.answer(text, reply_markup=get_balance_keyboard())
+    multi_styles = data.get("multi_styles")
+    if multi_styles:
+        await _start_multi_photoshoot(message, state, multi_styles, user_photo, force_regenerate)
         return
 
-    await state.set_state(MainStates.making_photoshoot_success)
+    # Тот же стиль + то же фото уже генерировали: отдаём готовое сразу, без очереди и списания
+    if not force_regenerate:
+        cached = find_cached_photoshoot(
+            style_title=style_title,
+            style_prompt=style_prompt,
+            user_photo_file_id=user_photo_file_id,
+            user_photo_file_unique_ids=[user_photo_file_unique_id],
+        )
+        if cached is not None:
+            cached_photo, cached_size = cached
+            await state.set_state(MainStates.making_photoshoot_success)
+            await send_output_photo(
+                message.bot,
+                message.chat.id,
+                cached_photo,
+                caption=photo_caption(cached_size),
+            )
+            await message.answer(
+                "Это фото в этом стиле уже было готово — повторно не списываем 🙌\n"
+                "Хочешь другой вариант? Нажми «🔄 Другой вариант в этом стиле».",
+                reply_markup=get_after_photoshoot_keyboard(),
+            )
+            return
 
-    await message.answer(
-        f"Готовлю твою фотосессию в стиле «{style_title}»… ⏳\n"
-        "Обычно это занимает 15–30 секунд.",
-    )
+    telegram_id = message.from_user.id
+    user_busy = user_generation_guard.is_busy(telegram_id)
+
+    await state.set_state(MainStates.making_photoshoot_success)
+    progress_message = await message.answer("Принял фото 👌 Ставлю фотосессию в очередь…")
 
-    await message.bot.send_chat_action(
+    # Генерацию выполняет воркер планировщика: он спишет оплату, обновит это сообщение
+    # и пришлёт результат. Хендлер не ждёт провайдера.
+    job = PhotoshootJob(
+        bot=message.bot,
+        telegram_id=telegram_id,
         chat_id=message.chat.id,
-        action="upload_photo",
+        style_title=style_title,
+        style_prompt=style_prompt,
+        file_ids=[user_photo_file_id],
+        file_unique_ids=[user_photo_file_unique_id],
+        force_regenerate=force_regenerate,
+        progress_message_id=progress_message.message_id,
+        style_id=data.get("current_style_id"),
+        # «Другой вариант» — сразу несколько вариантов одним запросом, если провайдер умеет
+        candidates=settings.GENERATION_VARIANT_CANDIDATES if force_regenerate else 1,
     )
-
     try:
-        generated_photo = await generate_photoshoot_image(
-            style_title=style_title,
-            style_prompt=style_prompt,
-            user_photo_file_id=user_photo_file_id,
-            bot=message.bot,
-        )
-    except Exception as e:
-        # Можно ещё залогировать e, но пользователю даём аккуратное сообщение
+        # заявка сохраняется в БД: после перезапуска бота её продолжат без повторного списания
+        admission = await enqueue_photoshoot_job(job)
+    except QueueFull as e:
+        # очередь заполнена или ждать слишком долго — отказываем до списания
         await state.set_state(MainStates.making_photoshoot_failed)
-        await message.answer(
-            "Упс… Что-то пошло не так при генерации фото 😔\n"
-            "Сервис обработки временно недоступен.\n"
-            "Попробуй, пожалуйста, ещё раз чуть позже.",
-        )
+        await progress_message.edit_text(str(e))
         return
 
-    await message.answer_photo(
-        photo=generated_photo,
-        caption="Готово! Вот твоё фото в 4K качестве ✨",
-    )
+    await _report_admission(progress_message, admission, user_busy)
 
-    await message.answer(
-        "Создать ещё одну фотосессию?",
-        reply_markup=get_after_photoshoot_keyboard(),
-    )
 
-    await state.set_state(MainStates.making_photoshoot_success)
-    try:
-        generated_photo = await generate_photoshoot_image(
-            style_title=style_title,
-            style_prompt=style_prompt,
-            user_photo_file_id=user_photo_file_id,
-            bot=message.bot,
+async def _report_admission(progress_message: Message, admission: Admission, user_busy: bool) -> None:
+    if user_busy and user_generation_guard.policy == POLICY_REPLACE:
+        await progress_message.edit_text(
+            "Я ещё готовлю твою предыдущую фотосессию ⏳\n"
+            "Эта начнётся сразу после неё."
         )
-
-        # Логируем успешную фотосессию
-        await log_photoshoot(
-            telegram_id=message.from_user.id,
-            style_title=style_title,
-            status=PhotoshootStatus.success,
-            cost_rub=0,  # пока не списываем деньги
-            cost_credits=0,  # и кредиты тоже
-            provider="comet_gemini_2_5_flash",
+    elif admission.ahead:
+        await progress_message.edit_text(
+            f"Фотосессия в очереди, перед тобой заявок: {admission.ahead} ⏳\n"
+            f"Примерное время ожидания: {format_eta(admission.eta_seconds)}. "
+            "Начну, как только освободится место — напишу сюда."
         )
 
-    except Exception as e:
-        # Логируем неудачу
-        await log_photoshoot(
-            telegram_id=message.from_user.id,
-            style_title=style_title,
-            status=PhotoshootStatus.failed,
-            cost_rub=0,
-            cost_credits=0,
-            provider="comet_gemini_2_5_flash",
-            error_message=str(e),
-        )
 
+async def _start_multi_photoshoot(
+    message: Message,
+    state: FSMContext,
+    multi_styles: list,
+    user_photo: PhotoSize,
+    force_regenerate: bool,
+) -> None:
+    """
+    Подборка: одно селфи — все выбранные стили одной заявкой (см. PhotoshootBatch).
+    Готовые из кеша стили воркер доставит без списания вместе с остальными.
+    """
+    telegram_id = message.from_user.id
+    user_busy = user_generation_guard.is_busy(telegram_id)
+
+    await state.set_state(MainStates.making_photoshoot_success)
+    progress_message = await message.answer(
+        f"Принял фото 👌 Ставлю подборку из {len(multi_styles)} стилей в очередь…"
+    )
+
+    batch = PhotoshootBatch(
+        bot=message.bot,
+        telegram_id=telegram_id,
+        chat_id=message.chat.id,
+        progress_message_id=progress_message.message_id,
+        jobs=[
+            PhotoshootJob(
+                bot=message.bot,
+                telegram_id=telegram_id,
+                chat_id=message.chat.id,
+                style_title=item["title"],
+                style_prompt=item["prompt"],
+                file_ids=[user_photo.file_id],
+                file_unique_ids=[user_photo.file_unique_id],
+                force_regenerate=force_regenerate,
+                progress_message_id=progress_message.message_id,
+                style_id=item["id"],
+            )
+            for item in multi_styles
+        ],
+    )
+    try:
+        admission = await enqueue_photoshoot_batch(batch)
+    except QueueFull as e:
         await state.set_state(MainStates.making_photoshoot_failed)
-        await message.answer(
-            "Упс… Что-то пошло не так при генерации фото 😔\n"
-            "Сервис обработки временно недоступен.\n"
-            "Попробуй, пожалуйста, ещё раз чуть позже.",
-        )
+        await progress_message.edit_text(str(e))
         return
 
+    await _report_admission(progress_message, admission, user_busy)
+
 
 @router.message(MainStates.making_photoshoot_process)
 async def handle_not_photo(message: Message, state: FSMContext):
@@ -335,6 +472,32 @@ async def back_to_main_menu(callback: CallbackQuery, state: FSMContext):
     )
 
 
+@router.callback_query(F.data == "regenerate_photoshoot")
+async def regenerate_photoshoot(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await callback.answer()
+
+    if data.get("multi_styles"):
+        await state.update_data(force_regenerate=True)
+        await state.set_state(MainStates.making_photoshoot_process)
+        await callback.message.answer(
+            "Сделаю новые варианты всей подборки 🔄\n"
+            "Пришли селфи ещё раз (можно то же самое).",
+        )
+        return
+
+    if not data.get("current_style_title"):
+        await get_album(callback.message, state)
+        return
+
+    await state.update_data(force_regenerate=True)
+    await state.set_state(MainStates.making_photoshoot_process)
+    await callback.message.answer(
+        f"Сделаю новый вариант в стиле «{data['current_style_title']}» 🔄\n"
+        "Пришли селфи ещё раз (можно то же самое).",
+    )
+
+
 @router.callback_query(F.data == "create_another_photoshoot")
 async def create_another_photoshoot(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
@@ -26,7 +26,7 @@ def get_photoshoot_entry_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
-def get_styles_keyboard() -> InlineKeyboardMarkup:
+def get_styles_keyboard(in_selection: bool = False, selected_count: int = 0) -> InlineKeyboardMarkup:
     left_inline_button = InlineKeyboardButton(
         text="⬅️",
         callback_data="previous",
@@ -39,13 +39,28 @@ def get_styles_keyboard() -> InlineKeyboardMarkup:
         text="Сделать такую же",
         callback_data="make_photoshoot",
     )
-
-    inline_keyboard_markup = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [left_inline_button, right_inline_button],
-            [make_photoshoot_button],
-        ]
+    # подборка: несколько стилей по одному селфи
+    toggle_style_button = InlineKeyboardButton(
+        text="✅ В подборке" if in_selection else "➕ В подборку",
+        callback_data="toggle_multi_style",
     )
+
+    rows = [
+        [left_inline_button, right_inline_button],
+        [make_photoshoot_button],
+        [toggle_style_button],
+    ]
+    if selected_count:
+        rows.append(
+            [
+                InlineKeyboardButton(
+                    text=f"📸 Сделать подборку ({selected_count})",
+                    callback_data="make_multi_photoshoot",
+                )
+            ]
+        )
+
+    inline_keyboard_markup = InlineKeyboardMarkup(inline_keyboard=rows)
     return inline_keyboard_markup
 
 
@@ -71,6 +86,12 @@ def get_balance_keyboard() -> InlineKeyboardMarkup:
 def get_after_photoshoot_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="🔄 Другой вариант в этом стиле",
+                    callback_data="regenerate_photoshoot",
+                )
+            ],
             [
                 InlineKeyboardButton(
                     text="Создать ещё одну фотосессию",
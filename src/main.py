@@ -8,7 +8,16 @@ from aiogram.filters import CommandStart, Command
 from aiogram.types import Message
 
 from src.config import settings
-from src.services.photoshoot import generate_photoshoot_image
+from src.services.photoshoot import generate_photoshoot_image, download_input_photos
+from src.services.providers import get_provider
+from src.services.delivery import send_output_document, send_output_photo
+from src.db import init_db
+from src.services.generation_jobs import generation_scheduler, recover_generation_jobs
+from src.services.key_pool import load_api_keys
+from src.services.offload import shutdown_codec_executor
+from src.services.output_store import get_output_store
+from src.services.preprocess import shutdown_preprocess_executor
+from src.services.provider_client import get_provider_client
 
 
 logger = logging.getLogger(__name__)
@@ -64,8 +73,16 @@ async def handle_photo(message: Message, bot: Bot) -> None:
 
     # Самое большое фото (последнее) — это один file_id
     file_id = message.photo[-1].file_id
+    file_unique_id = message.photo[-1].file_unique_id
 
-    waiting_msg = await message.answer("Генерирую картинку, это может занять немного времени...")
+    # качаем фото параллельно с отправкой сообщения «Генерирую…»
+    input_photos_task = asyncio.create_task(download_input_photos(bot, [file_id], [file_unique_id]))
+
+    try:
+        waiting_msg = await message.answer("Генерирую картинку, это может занять немного времени...")
+    except Exception:
+        input_photos_task.cancel()
+        raise
 
     try:
         # ✅ фикс: используем правильный аргумент user_photo_file_ids
@@ -74,6 +91,8 @@ async def handle_photo(message: Message, bot: Bot) -> None:
             style_prompt=prompt_text,
             user_photo_file_ids=[file_id],
             bot=bot,
+            input_photos=await input_photos_task,
+            user_photo_file_unique_ids=[file_unique_id],
         )
     except RuntimeError as e:
         logger.exception("Ошибка генерации изображения (RuntimeError)")
@@ -91,16 +110,42 @@ async def handle_photo(message: Message, bot: Bot) -> None:
         return
 
     await waiting_msg.delete()
-    await message.answer_photo(result_file, caption="Готово!")
-    await message.answer_document(result_file)
+    # каждый вид (фото/документ) грузится один раз, повторные отправки идут по file_id
+    await send_output_photo(bot, message.chat.id, result_file, caption="Готово!")
+    await send_output_document(bot, message.chat.id, result_file)
 
 @dp.message()
 async def handle_just_text(message: Message) -> None:
     await message.answer("Чтобы получить картинку, пришли, пожалуйста, фото с подписью-промтом.")
 
 
+async def on_startup() -> None:
+    # уборка недописанных файлов и восстановление индекса хранилища
+    await get_output_store().start()
+
+    client = get_provider_client()
+    await client.start()
+    if settings.PROVIDER_WARMUP:
+        await client.warmup([get_provider().base_url], connections=settings.PROVIDER_WARMUP_CONNECTIONS)
+
+    # задачи, оборванные перезапуском: доделываем без повторного списания
+    await init_db()
+    await load_api_keys()
+    await recover_generation_jobs(bot)
+
+
+async def on_shutdown() -> None:
+    # воркеры генераций останавливаем до закрытия соединений с провайдером
+    await generation_scheduler.stop()
+    await get_provider_client().close()
+    shutdown_codec_executor()
+    shutdown_preprocess_executor()
+
+
 async def main() -> None:
     logger.info("Запуск бота")
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     await dp.start_polling(bot)
 
 
@@ -5,3 +5,6 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 # Папка с картинками стилей
 IMG_DIR = BASE_DIR / "img"
+
+# Хранилище сгенерированных картинок (см. services/output_store.py)
+OUTPUT_DIR = BASE_DIR / "outputs"
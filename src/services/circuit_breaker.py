@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from src.config import settings
+from src.services.providers import (
+    ERROR_AUTH,
+    ERROR_BAD_REQUEST,
+    ERROR_CIRCUIT_OPEN,
+    ERROR_NO_IMAGE,
+    ERROR_QUOTA,
+    ERROR_RATE_LIMIT,
+    ERROR_TIMEOUT,
+    ProviderError,
+    ProviderUnavailable,
+)
+
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# Провайдер жив и ответил, для автомата это не сбой: ошибка в наших параметрах или входе
+# (фильтр безопасности)
+NOT_PROVIDER_FAULT = (ERROR_BAD_REQUEST, ERROR_NO_IMAGE)
+# Беда конкретного ключа (его выводит из ротации пул ключей, key_pool.py) или троттлинг:
+# о здоровье провайдера ничего не говорит — автомат не трогаем, ни в плюс, ни в минус
+NEUTRAL_ERRORS = (ERROR_AUTH, ERROR_QUOTA, ERROR_RATE_LIMIT)
+# На что AIMD-лимит отвечает снижением параллельности
+BACKOFF_ERRORS = (ERROR_RATE_LIMIT, ERROR_TIMEOUT)
+
+
+class CircuitBreaker:
+    """
+    Автомат провайдера: closed → (серия сбоев) → open → (пауза) → half_open → (пробный запрос)
+    → closed или снова open.
+
+    Пока автомат разомкнут, запросы не отправляются вовсе — ошибка сразу (или запасной провайдер),
+    вместо того чтобы каждая заявка из очереди ждала свой таймаут.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, open_seconds: float) -> None:
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.last_error_class: Optional[str] = None
+
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            return STATE_HALF_OPEN
+        return self._state
+
+    def allows_request(self) -> bool:
+        """
+        Пропустит ли автомат запрос прямо сейчас (без резервирования пробного слота).
+        """
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        return state == STATE_HALF_OPEN and not self._probe_in_flight
+
+    def _open(self, error_class: str) -> None:
+        if self._state != STATE_OPEN:
+            self.opened += 1
+            logger.warning("Провайдер %s: автомат разомкнут (%s)", self.name, error_class)
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._failures = 0
+
+    def _on_success(self) -> None:
+        if self._state != STATE_CLOSED:
+            logger.info("Провайдер %s: автомат снова замкнут", self.name)
+        self._state = STATE_CLOSED
+        self._failures = 0
+
+    def _on_failure(self, error_class: str) -> None:
+        self.last_error_class = error_class
+        if self._state != STATE_CLOSED:
+            self._open(error_class)
+            return
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            self._open(error_class)
+
+    def _release_probe(self, probe: bool) -> None:
+        # пробный запрос ничего не показал о провайдере: слот освобождаем, счётчики не трогаем
+        if probe and self._state == STATE_HALF_OPEN:
+            self._state = STATE_OPEN
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """
+        Оборачивает один запрос к провайдеру: при разомкнутом автомате — ProviderError(circuit_open)
+        без запроса; иначе итог запроса (ProviderError.error_class) двигает состояние.
+        """
+        state = self.state
+        if state == STATE_OPEN or (state == STATE_HALF_OPEN and self._probe_in_flight):
+            self.rejected += 1
+            raise ProviderUnavailable(
+                "Сервис генерации сейчас недоступен. Попробуй через пару минут 🙏",
+                ERROR_CIRCUIT_OPEN,
+                provider=self.name,
+            )
+
+        probe = state == STATE_HALF_OPEN
+        if probe:
+            self._state = STATE_HALF_OPEN
+            self._probe_in_flight = True
+        try:
+            yield
+        except ProviderError as e:
+            if e.error_class in NOT_PROVIDER_FAULT:
+                self._on_success()
+            elif e.error_class in NEUTRAL_ERRORS:
+                self._release_probe(probe)
+            else:
+                self._on_failure(e.error_class)
+            raise
+        except BaseException:
+            # отмена (проигравший при хеджировании) или наша ошибка — о провайдере ничего не говорит
+            self._release_probe(probe)
+            raise
+        else:
+            self._on_success()
+        finally:
+            if probe:
+                self._probe_in_flight = False
+
+    @property
+    def stats(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "last_error_class": self.last_error_class,
+        }
+
+
+class AdaptiveLimit:
+    """
+    AIMD-лимит одновременных запросов к провайдеру: каждый быстрый успешный ответ
+    понемногу поднимает лимит (+1 за «окно» из limit запросов), 429 или таймаут —
+    делит его пополам. Лишние запросы ждут свободного места, а не давят на провайдера.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+        backoff: float = 0.5,
+    ) -> None:
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.latency_target = latency_target
+        self.backoff = backoff
+
+        self.in_flight = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+    def _wake(self) -> None:
+        free = self.current - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def _increase(self) -> None:
+        before = self.current
+        self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        if self.current > before:
+            self.increases += 1
+            self._wake()
+
+    def _decrease(self, error_class: str) -> None:
+        before = self.current
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        if self.current < before:
+            self.decreases += 1
+            logger.info("Провайдер %s: %s — параллельность %s → %s", self.name, error_class, before, self.current)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        while self.in_flight >= self.current:
+            waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                # нас разбудили и сразу отменили — место отдаём следующему
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+        started_at = time.monotonic()
+        try:
+            yield
+        except ProviderError as e:
+            if e.error_class in BACKOFF_ERRORS:
+                self._decrease(e.error_class)
+            raise
+        else:
+            if time.monotonic() - started_at <= self.latency_target:
+                self._increase()
+        finally:
+            self.in_flight -= 1
+            self._wake()
+
+    @property
+    def stats(self) -> Dict[str, object]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_limits: Dict[str, AdaptiveLimit] = {}
+
+
+def get_breaker(provider_name: str) -> CircuitBreaker:
+    breaker = _breakers.get(provider_name)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            name=provider_name,
+            failure_threshold=settings.PROVIDER_BREAKER_FAILURE_THRESHOLD,
+            open_seconds=settings.PROVIDER_BREAKER_OPEN_SECONDS,
+        )
+        _breakers[provider_name] = breaker
+    return breaker
+
+
+def get_limit(provider_name: str) -> AdaptiveLimit:
+    limit = _limits.get(provider_name)
+    if limit is None:
+        limit = AdaptiveLimit(
+            name=provider_name,
+            initial=settings.PROVIDER_CONCURRENCY_INITIAL,
+            min_limit=settings.PROVIDER_CONCURRENCY_MIN,
+            max_limit=settings.PROVIDER_CONCURRENCY_MAX,
+            latency_target=settings.PROVIDER_CONCURRENCY_LATENCY_TARGET_SECONDS,
+        )
+        _limits[provider_name] = limit
+    return limit
+
+
+def gate_stats() -> Dict[str, Dict[str, object]]:
+    names = sorted(set(_breakers) | set(_limits))
+    return {
+        name: {
+            "breaker": get_breaker(name).stats,
+            "concurrency": get_limit(name).stats,
+        }
+        for name in names
+    }
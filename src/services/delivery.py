@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InputFile, InputMediaPhoto, Message
+
+from src.config import settings
+from src.services.output_store import StoredOutput
+
+
+logger = logging.getLogger(__name__)
+
+PHOTO = "photo"
+DOCUMENT = "document"
+
+# Telegram: в одном альбоме (send_media_group) от 2 до 10 элементов
+MEDIA_GROUP_MAX = 10
+
+
+class FileIdCache:
+    """
+    file_id, который Telegram вернул после первой загрузки файла.
+    Ключ — (ключ контента, вид отправки): file_id фото и документа в Telegram не взаимозаменяемы.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._items: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, kind: str) -> Optional[str]:
+        file_id = self._items.get((key, kind))
+        if file_id is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end((key, kind))
+        self.hits += 1
+        return file_id
+
+    def put(self, key: str, kind: str, file_id: str) -> None:
+        self._items[(key, kind)] = file_id
+        self._items.move_to_end((key, kind))
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def forget(self, key: str, kind: str) -> None:
+        self._items.pop((key, kind), None)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+file_id_cache = FileIdCache(max_entries=settings.FILE_ID_CACHE_SIZE)
+
+
+def output_key(output: StoredOutput) -> str:
+    return f"output:{output.digest}"
+
+
+def style_image_key(image_filename: str) -> str:
+    return f"style:{image_filename}"
+
+
+def _sent_file_id(sent: Union[Message, bool], kind: str) -> Optional[str]:
+    if not isinstance(sent, Message):
+        return None
+    if kind == PHOTO and sent.photo:
+        return sent.photo[-1].file_id
+    if kind == DOCUMENT and sent.document:
+        return sent.document.file_id
+    return None
+
+
+async def send_photo_cached(
+    bot: Bot,
+    chat_id: int,
+    key: str,
+    photo: InputFile,
+    **kwargs,
+) -> Message:
+    """
+    send_photo, который загружает файл только в первый раз,
+    а дальше отправляет его по сохранённому file_id.
+    """
+    file_id = file_id_cache.get(key, PHOTO)
+    if file_id is not None:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            logger.warning("file_id для %s больше не принимается (%s), загружаем заново", key, e)
+            file_id_cache.forget(key, PHOTO)
+
+    sent = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+    new_file_id = _sent_file_id(sent, PHOTO)
+    if new_file_id:
+        file_id_cache.put(key, PHOTO, new_file_id)
+    return sent
+
+
+async def send_document_cached(
+    bot: Bot,
+    chat_id: int,
+    key: str,
+    document: InputFile,
+    **kwargs,
+) -> Message:
+    """
+    То же для send_document (оригинал без сжатия Telegram).
+    """
+    file_id = file_id_cache.get(key, DOCUMENT)
+    if file_id is not None:
+        try:
+            return await bot.send_document(chat_id=chat_id, document=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            logger.warning("file_id для %s больше не принимается (%s), загружаем заново", key, e)
+            file_id_cache.forget(key, DOCUMENT)
+
+    sent = await bot.send_document(chat_id=chat_id, document=document, **kwargs)
+    new_file_id = _sent_file_id(sent, DOCUMENT)
+    if new_file_id:
+        file_id_cache.put(key, DOCUMENT, new_file_id)
+    return sent
+
+
+async def edit_photo_cached(
+    message: Message,
+    key: str,
+    photo: InputFile,
+    caption: Optional[str] = None,
+    **kwargs,
+) -> Union[Message, bool]:
+    """
+    edit_media с фото (карусель стилей): повторные показы идут по file_id.
+    """
+    file_id = file_id_cache.get(key, PHOTO)
+    if file_id is not None:
+        try:
+            return await message.edit_media(
+                media=InputMediaPhoto(media=file_id, caption=caption),
+                **kwargs,
+            )
+        except TelegramBadRequest as e:
+            # «message is not modified» — не проблема file_id, отдаём наверх как есть
+            if "message is not modified" in str(e):
+                raise
+            logger.warning("file_id для %s больше не принимается (%s), загружаем заново", key, e)
+            file_id_cache.forget(key, PHOTO)
+
+    edited = await message.edit_media(
+        media=InputMediaPhoto(media=photo, caption=caption),
+        **kwargs,
+    )
+    new_file_id = _sent_file_id(edited, PHOTO)
+    if new_file_id:
+        file_id_cache.put(key, PHOTO, new_file_id)
+    return edited
+
+
+async def _send_photo_group(
+    bot: Bot,
+    chat_id: int,
+    photos: Sequence[Tuple[str, InputFile, Optional[str]]],
+    **kwargs,
+) -> List[Message]:
+    """
+    Один альбом (2..MEDIA_GROUP_MAX фото): загруженные раньше — по file_id, новые — файлом.
+    """
+    file_ids = [file_id_cache.get(key, PHOTO) for key, _, _ in photos]
+    media = [
+        InputMediaPhoto(media=file_id or photo, caption=caption)
+        for (_, photo, caption), file_id in zip(photos, file_ids)
+    ]
+    try:
+        sent = await bot.send_media_group(chat_id=chat_id, media=media, **kwargs)
+    except TelegramBadRequest as e:
+        if not any(file_ids):
+            raise
+        # какой из file_id устарел, Telegram не говорит — забываем все и загружаем альбом заново
+        logger.warning("file_id в альбоме больше не принимается (%s), загружаем заново", e)
+        for key, _, _ in photos:
+            file_id_cache.forget(key, PHOTO)
+        media = [InputMediaPhoto(media=photo, caption=caption) for _, photo, caption in photos]
+        sent = await bot.send_media_group(chat_id=chat_id, media=media, **kwargs)
+
+    for (key, _, _), message in zip(photos, sent):
+        new_file_id = _sent_file_id(message, PHOTO)
+        if new_file_id:
+            file_id_cache.put(key, PHOTO, new_file_id)
+    return sent
+
+
+async def send_photo_group_cached(
+    bot: Bot,
+    chat_id: int,
+    photos: Sequence[Tuple[str, InputFile, Optional[str]]],
+    **kwargs,
+) -> List[Message]:
+    """
+    Несколько фото одним альбомом (ключ, файл, подпись): больше MEDIA_GROUP_MAX — несколькими
+    альбомами, одиночное фото — обычным send_photo (альбом из одного Telegram не принимает).
+    """
+    sent: List[Message] = []
+    for start in range(0, len(photos), MEDIA_GROUP_MAX):
+        chunk = photos[start:start + MEDIA_GROUP_MAX]
+        if len(chunk) == 1:
+            key, photo, caption = chunk[0]
+            sent.append(await send_photo_cached(bot, chat_id, key, photo, caption=caption, **kwargs))
+        else:
+            sent.extend(await _send_photo_group(bot, chat_id, chunk, **kwargs))
+    return sent
+
+
+async def send_output_photo(bot: Bot, chat_id: int, output: StoredOutput, **kwargs) -> Message:
+    return await send_photo_cached(bot, chat_id, output_key(output), output.as_input_file(), **kwargs)
+
+
+async def send_output_document(bot: Bot, chat_id: int, output: StoredOutput, **kwargs) -> Message:
+    return await send_document_cached(bot, chat_id, output_key(output), output.as_input_file(), **kwargs)
+
+
+async def edit_output_photo(message: Message, output: StoredOutput, caption: Optional[str] = None, **kwargs) -> Union[Message, bool]:
+    return await edit_photo_cached(message, output_key(output), output.as_input_file(), caption=caption, **kwargs)
+
+
+async def send_output_media_group(
+    bot: Bot,
+    chat_id: int,
+    outputs: Sequence[StoredOutput],
+    captions: Optional[Sequence[Optional[str]]] = None,
+    **kwargs,
+) -> List[Message]:
+    captions = list(captions) if captions is not None else [None] * len(outputs)
+    photos = [
+        (output_key(output), output.as_input_file(), caption)
+        for output, caption in zip(outputs, captions)
+    ]
+    return await send_photo_group_cached(bot, chat_id, photos, **kwargs)
@@ -0,0 +1,435 @@
+from __future__ import annotations
+
+import binascii
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, List, Optional, Sequence
+
+
+# Ключи Google-формата generateContent (провайдеры отдают то camelCase, то snake_case)
+INLINE_DATA_KEYS = ("inlineData", "inline_data")
+MIME_TYPE_KEYS = ("mimeType", "mime_type")
+
+# Сколько первых байт ответа держим для логов
+RESPONSE_HEAD_BYTES = 512
+
+# Ограничение на «мелкие» строки (ключи, mimeType), которые собираем целиком
+MAX_CAPTURED_STRING = 4096
+
+# Сколько исходных байт картинки кодируем за раз (кратно 3 — base64 без паддинга в середине)
+REQUEST_CHUNK_RAW_BYTES = 48 * 1024
+
+# Метка места для base64 в JSON-каркасе запроса (json.dumps экранирует NUL как \u0000)
+_BLOB_MARK = "\u0000blob:{}\u0000"
+_BLOB_MARK_RE = re.compile(r"\\u0000blob:(\d+)\\u0000")
+
+# run(func, *args, size=...) — исполнитель кодек-работы (см. src.services.offload.run_codec)
+CodecRunner = Callable[..., Awaitable[Any]]
+
+_QUOTE = 0x22
+_LBRACE = 0x7B
+_RBRACE = 0x7D
+_LBRACKET = 0x5B
+_RBRACKET = 0x5D
+_COLON = 0x3A
+_COMMA = 0x2C
+_WHITESPACE = frozenset(b" \t\r\n")
+_BASE64_ALPHABET = frozenset(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=")
+
+# Роли строки, которую сейчас читаем
+_SKIP = 0
+_KEY = 1
+_CAPTURE = 2
+_DATA = 3
+
+
+class StreamDecodeError(ValueError):
+    """
+    Ответ провайдера не удалось разобрать потоково (битый/обрезанный JSON).
+    """
+
+
+class ResponseTooLargeError(StreamDecodeError):
+    """
+    Ответ провайдера больше разрешённого лимита.
+    """
+
+
+class _Base64ChunkDecoder:
+    """
+    Декодирует base64 кусками кратными 4 символам и сразу пишет байты в sink.
+    """
+
+    def __init__(self, write: Callable[[bytes], object]) -> None:
+        self._write = write
+        self._tail = b""
+        self.size = 0
+
+    def feed(self, data: bytes) -> None:
+        if self._tail:
+            data = self._tail + data
+        cut = len(data) - len(data) % 4
+        self._tail = data[cut:]
+        if cut:
+            try:
+                decoded = binascii.a2b_base64(data[:cut])
+            except binascii.Error as e:
+                raise StreamDecodeError(f"Некорректный base64 в ответе: {e}") from e
+            self._write(decoded)
+            self.size += len(decoded)
+
+    def close(self) -> None:
+        if not self._tail:
+            return
+        # некоторые провайдеры обрезают паддинг
+        tail = self._tail + b"=" * (-len(self._tail) % 4)
+        self._tail = b""
+        self.feed(tail)
+
+
+@dataclass
+class DecodedImage:
+    """
+    Картинка, декодированная из inlineData прямо в sink.
+    """
+
+    index: int
+    sink: BinaryIO
+    size: int = 0
+    mime_type: Optional[str] = None
+
+
+class InlineImageStreamDecoder:
+    """
+    Инкрементальный разбор JSON-ответа generateContent.
+
+    Ответ не держится в памяти целиком: структура JSON разбирается по мере прихода байт,
+    а строки inlineData.data декодируются из base64 кусками прямо в sink
+    (open_sink() вызывается на каждую картинку). Остальные большие строки пропускаются.
+
+    После close() доступны:
+    - candidates_count — сколько кандидатов вернул сервис,
+    - images — декодированные картинки (не больше max_images).
+    """
+
+    def __init__(
+        self,
+        open_sink: Callable[[], BinaryIO],
+        max_images: int = 1,
+        max_bytes: Optional[int] = None,
+    ) -> None:
+        self._open_sink = open_sink
+        self._max_images = max_images
+        self._max_bytes = max_bytes
+
+        self.received = 0
+        self.head = b""
+        self.candidates_count = 0
+        self.images: List[DecodedImage] = []
+
+        # стек контейнеров: [is_object, name, current_key, expect_key]
+        self._stack: List[list] = []
+        self._root_seen = False
+        self._done = False
+
+        self._role: Optional[int] = None
+        self._buf = bytearray()
+        self._esc: Optional[bytes] = None
+
+        self._slot: Optional[DecodedImage] = None
+        self._slot_mime: Optional[str] = None
+        self._b64: Optional[_Base64ChunkDecoder] = None
+
+    # ---------- публичное API ----------
+
+    def feed(self, chunk: bytes) -> None:
+        self.received += len(chunk)
+        if self._max_bytes is not None and self.received > self._max_bytes:
+            raise ResponseTooLargeError(
+                f"Ответ сервиса больше лимита {self._max_bytes} байт"
+            )
+        if len(self.head) < RESPONSE_HEAD_BYTES:
+            self.head += chunk[: RESPONSE_HEAD_BYTES - len(self.head)]
+
+        i = 0
+        n = len(chunk)
+        while i < n:
+            if self._role is not None:
+                i = self._consume_string(chunk, i, n)
+                continue
+
+            c = chunk[i]
+            i += 1
+
+            if c in _WHITESPACE:
+                continue
+            if self._done:
+                raise StreamDecodeError("Лишние данные после конца JSON")
+
+            if c == _QUOTE:
+                self._begin_string()
+            elif c == _LBRACE:
+                self._open(is_object=True)
+            elif c == _LBRACKET:
+                self._open(is_object=False)
+            elif c == _RBRACE or c == _RBRACKET:
+                self._close_container(is_object=(c == _RBRACE))
+            elif c == _COLON:
+                if not self._stack or not self._stack[-1][0]:
+                    raise StreamDecodeError("Неожиданный ':' в ответе")
+                self._stack[-1][3] = False
+            elif c == _COMMA:
+                if not self._stack:
+                    raise StreamDecodeError("Неожиданный ',' в ответе")
+                top = self._stack[-1]
+                if top[0]:
+                    top[2] = None
+                    top[3] = True
+            elif not self._stack:
+                # числа/true/false/null на верхнем уровне — это не наш ответ
+                raise StreamDecodeError("Ответ сервиса не является JSON-объектом")
+
+    def feed_many(self, chunks: Sequence[bytes]) -> None:
+        """
+        Скармливает пачку кусков подряд (удобно отдавать одним вызовом в пул потоков).
+        """
+        for chunk in chunks:
+            self.feed(chunk)
+
+    def close(self) -> None:
+        if not self._root_seen:
+            raise StreamDecodeError("Пустой ответ сервиса")
+        if self._stack or self._role is not None:
+            raise StreamDecodeError("Ответ сервиса оборвался на середине JSON")
+
+    # ---------- контейнеры ----------
+
+    def _open(self, is_object: bool) -> None:
+        if not self._stack:
+            if self._root_seen or not is_object:
+                raise StreamDecodeError("Ответ сервиса не является JSON-объектом")
+            self._root_seen = True
+            self._stack.append([True, None, None, True])
+            return
+
+        parent = self._stack[-1]
+        # имя контейнера: ключ в объекте-родителе, для элементов массива — имя массива
+        name = parent[2] if parent[0] else parent[1]
+
+        if is_object and not parent[0] and name == "candidates" and len(self._stack) == 2:
+            self.candidates_count += 1
+
+        if is_object and name in INLINE_DATA_KEYS:
+            self._slot = None
+            self._slot_mime = None
+
+        self._stack.append([is_object, name, None, is_object])
+
+    def _close_container(self, is_object: bool) -> None:
+        if not self._stack or self._stack[-1][0] != is_object:
+            raise StreamDecodeError("Несбалансированные скобки в ответе")
+        frame = self._stack.pop()
+
+        if frame[0] and frame[1] in INLINE_DATA_KEYS:
+            self._slot = None
+            self._slot_mime = None
+
+        if not self._stack:
+            self._done = True
+
+    # ---------- строки ----------
+
+    def _begin_string(self) -> None:
+        if not self._stack:
+            raise StreamDecodeError("Ответ сервиса не является JSON-объектом")
+
+        top = self._stack[-1]
+        self._buf.clear()
+
+        if top[0] and top[3]:
+            self._role = _KEY
+            return
+
+        if top[0] and top[1] in INLINE_DATA_KEYS:
+            if top[2] in MIME_TYPE_KEYS:
+                self._role = _CAPTURE
+                return
+            if top[2] == "data" and self._slot is None and len(self.images) < self._max_images:
+                self._slot = DecodedImage(
+                    index=len(self.images),
+                    sink=self._open_sink(),
+                    mime_type=self._slot_mime,
+                )
+                self.images.append(self._slot)
+                self._b64 = _Base64ChunkDecoder(self._slot.sink.write)
+                self._role = _DATA
+                return
+
+        self._role = _SKIP
+
+    def _consume_string(self, chunk: bytes, i: int, n: int) -> int:
+        if self._esc is not None:
+            self._esc += chunk[i:i + 1]
+            if len(self._esc) == 6 or (len(self._esc) == 2 and self._esc[1] != ord("u")):
+                self._emit_escape(self._esc)
+                self._esc = None
+            return i + 1
+
+        q = chunk.find(b'"', i)
+        end = n if q == -1 else q
+        bs = chunk.find(b"\\", i, end)
+
+        if bs != -1:
+            self._emit_raw(chunk[i:bs])
+            self._esc = b"\\"
+            return bs + 1
+
+        self._emit_raw(chunk[i:end])
+        if q == -1:
+            return n
+
+        self._end_string()
+        return q + 1
+
+    def _emit_raw(self, segment: bytes) -> None:
+        if not segment:
+            return
+        if self._role == _DATA:
+            self._b64.feed(segment)
+        elif self._role in (_KEY, _CAPTURE):
+            if len(self._buf) + len(segment) > MAX_CAPTURED_STRING:
+                raise StreamDecodeError("Слишком длинный ключ или mimeType в ответе")
+            self._buf += segment
+
+    def _emit_escape(self, escape: bytes) -> None:
+        if self._role == _DATA:
+            # "\/" и подобные экранирования внутри base64; переносы строк просто пропускаем
+            try:
+                ch = json.loads(b'"' + escape + b'"')
+            except ValueError as e:
+                raise StreamDecodeError("Некорректное экранирование в ответе") from e
+            raw = ch.encode("ascii", errors="ignore")
+            if raw and raw[0] in _BASE64_ALPHABET:
+                self._b64.feed(raw)
+        elif self._role in (_KEY, _CAPTURE):
+            self._buf += escape
+
+    def _end_string(self) -> None:
+        role, self._role = self._role, None
+
+        if role == _DATA:
+            self._b64.close()
+            self._slot.size = self._b64.size
+            self._b64 = None
+            return
+
+        if role in (_KEY, _CAPTURE):
+            try:
+                value = json.loads(b'"' + bytes(self._buf) + b'"')
+            except ValueError as e:
+                raise StreamDecodeError("Некорректная строка в ответе") from e
+            if role == _KEY:
+                self._stack[-1][2] = value
+            else:
+                self._slot_mime = value
+                if self._slot is not None:
+                    self._slot.mime_type = value
+
+
+# ---------- Запрос: потоковое кодирование inline_data ----------
+
+
+def blob_placeholder(index: int) -> str:
+    """
+    Заглушка для поля "data" в payload: на её место StreamingJsonBody
+    подставит base64 картинки blobs[index], кодируя его на лету.
+    """
+    return _BLOB_MARK.format(index)
+
+
+class StreamingJsonBody:
+    """
+    Тело JSON-запроса, которое отдаётся кусками (async-итератор для aiohttp data=).
+
+    Каркас payload (промпт, generationConfig) сериализуется один раз и маленький,
+    а base64 входных фото генерируется из исходных байт по кускам прямо при отправке —
+    в памяти не появляется ни base64-строк, ни полного JSON.
+
+    Размер тела известен заранее (size), поэтому можно выставить Content-Length.
+    Итерироваться можно несколько раз (например, для повторной отправки).
+
+    Если передан run_codec — кодирование кусков идёт через него (например, в пул потоков).
+    Если переданы encoded_blobs (base64 тех же blobs, см. encode_blobs) — они отдаются как есть,
+    без кодирования: так несколько запросов с одними фото кодируют их один раз.
+    """
+
+    def __init__(
+        self,
+        payload: dict,
+        blobs: Sequence[bytes],
+        chunk_raw_bytes: int = REQUEST_CHUNK_RAW_BYTES,
+        run_codec: Optional[CodecRunner] = None,
+        encoded_blobs: Optional[Sequence[bytes]] = None,
+    ) -> None:
+        self._blobs = list(blobs)
+        self._chunk_raw_bytes = max(3, chunk_raw_bytes - chunk_raw_bytes % 3)
+        self._run_codec = run_codec
+        self._encoded = list(encoded_blobs) if encoded_blobs is not None else None
+        if self._encoded is not None and len(self._encoded) != len(self._blobs):
+            raise ValueError("encoded_blobs должны соответствовать blobs один к одному")
+
+        # [текст, индекс blob, текст, индекс blob, ..., текст]
+        pieces = _BLOB_MARK_RE.split(json.dumps(payload))
+        self._texts = [p.encode("utf-8") for p in pieces[0::2]]
+        self._order = [int(i) for i in pieces[1::2]]
+
+        for i in self._order:
+            if i >= len(self._blobs):
+                raise ValueError(f"В payload есть ссылка на blob {i}, а передано {len(self._blobs)}")
+
+    @property
+    def size(self) -> int:
+        total = sum(len(t) for t in self._texts)
+        for i in self._order:
+            total += 4 * ((len(self._blobs[i]) + 2) // 3)
+        return total
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        step = self._chunk_raw_bytes
+        for n, text in enumerate(self._texts):
+            if text:
+                yield text
+            if n >= len(self._order):
+                break
+            if self._encoded is not None:
+                encoded = memoryview(self._encoded[self._order[n]])
+                encoded_step = step // 3 * 4
+                for start in range(0, len(encoded), encoded_step):
+                    yield bytes(encoded[start:start + encoded_step])
+                continue
+            view = memoryview(self._blobs[self._order[n]])
+            for start in range(0, len(view), step):
+                piece = view[start:start + step]
+                if self._run_codec is None:
+                    yield _encode_piece(piece)
+                else:
+                    yield await self._run_codec(_encode_piece, piece, size=len(piece))
+
+
+def _encode_piece(piece: memoryview) -> bytes:
+    return binascii.b2a_base64(piece, newline=False)
+
+
+async def encode_blobs(blobs: Sequence[bytes], run_codec: Optional[CodecRunner] = None) -> List[bytes]:
+    """
+    base64 входных фото целиком — для StreamingJsonBody(encoded_blobs=...),
+    когда с одними и теми же фото уходит несколько запросов.
+    """
+    encoded: List[bytes] = []
+    for blob in blobs:
+        if run_codec is None:
+            encoded.append(_encode_piece(memoryview(blob)))
+        else:
+            encoded.append(await run_codec(_encode_piece, memoryview(blob), size=len(blob)))
+    return encoded
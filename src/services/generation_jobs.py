@@ -0,0 +1,684 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from aiogram import Bot
+from aiogram.types import Message
+
+from src.config import settings
+from src.data.styles import PHOTOSHOOT_PRICE
+from src.db import (
+    GenerationJob,
+    GenerationJobStatus,
+    PhotoshootStatus,
+    consume_photoshoot_credit_or_balance,
+    create_generation_job,
+    get_unfinished_generation_jobs,
+    get_user_by_telegram_id,
+    log_photoshoot,
+    start_generation_job_attempt,
+    update_generation_job,
+)
+from src.keyboards import get_after_photoshoot_keyboard
+from src.services.delivery import (
+    edit_output_photo,
+    send_output_document,
+    send_output_media_group,
+    send_output_photo,
+)
+from src.services.output_store import StoredOutput, get_output_store
+from src.services.photoshoot import (
+    IMAGE_SIZE_DEFAULT,
+    download_input_photos,
+    find_cached_photoshoot,
+    generate_photoshoot_image,
+    generate_photoshoot_variants,
+    photo_caption,
+    prepare_input_photos,
+)
+from src.services.providers import get_provider
+from src.services.quality import quality_controller
+from src.services.admins import is_admin
+from src.services.scheduler import (
+    TIER_ADMIN,
+    TIER_BALANCE,
+    TIER_CREDITS,
+    TIER_FREE,
+    Admission,
+    GenerationScheduler,
+    QueueFull,
+)
+from src.services.user_guard import GenerationInProgress, GenerationReplaced, user_generation_guard
+
+
+logger = logging.getLogger(__name__)
+
+# Двухфазная выдача (settings.GENERATION_PROGRESSIVE_DELIVERY)
+PROGRESSIVE_EDIT = "edit"  # финальное фото заменяет превью в том же сообщении
+PROGRESSIVE_DOCUMENT = "document"  # финальное фото — отдельным файлом, превью остаётся
+
+FAILED_TEXT = (
+    "Упс… Что-то пошло не так при генерации фото 😔\n"
+    "Сервис обработки временно недоступен.\n"
+    "Попробуй, пожалуйста, ещё раз чуть позже."
+)
+
+
+@dataclass
+class PhotoshootJob:
+    """
+    Заявка на фотосессию: всё, что нужно воркеру, чтобы сгенерировать и доставить результат.
+    """
+
+    bot: Bot
+    telegram_id: int
+    chat_id: int
+    style_title: str
+    style_prompt: Optional[str]
+    file_ids: List[str]
+    file_unique_ids: List[str] = field(default_factory=list)
+    force_regenerate: bool = False
+    progress_message_id: Optional[int] = None
+
+    # запись в generation_jobs (None — задача не сохраняется в БД)
+    job_id: Optional[int] = None
+    style_id: Optional[int] = None
+    charged: bool = False
+    result_digest: Optional[str] = None
+
+    # уровень пользователя в справедливой очереди (см. resolve_user_tier)
+    tier: str = TIER_FREE
+
+    # размер результата, выбранный при запуске (см. quality.py)
+    image_size: str = IMAGE_SIZE_DEFAULT
+
+    # сколько вариантов просить одним запросом (альбомом); в БД не хранится —
+    # задача, поднятая после перезапуска, делает один вариант
+    candidates: int = 1
+
+    @classmethod
+    def from_row(cls, bot: Bot, row: GenerationJob) -> "PhotoshootJob":
+        return cls(
+            bot=bot,
+            telegram_id=row.telegram_id,
+            chat_id=row.chat_id,
+            style_title=row.style_title,
+            style_prompt=row.style_prompt,
+            file_ids=row.file_ids.split(),
+            file_unique_ids=row.file_unique_ids.split(),
+            force_regenerate=row.force_regenerate,
+            progress_message_id=row.progress_message_id,
+            job_id=row.id,
+            style_id=row.style_id,
+            charged=row.charged,
+            result_digest=row.result_digest,
+            image_size=row.image_size or IMAGE_SIZE_DEFAULT,
+        )
+
+
+@dataclass
+class PhotoshootBatch:
+    """
+    Подборка: несколько стилей по одному селфи. В очереди это одна заявка, а каждый стиль —
+    своя PhotoshootJob (своя запись в generation_jobs, своё списание и строка в логе).
+    Фото качаются, обрабатываются и кодируются один раз, запросы по стилям идут параллельно
+    (в пределах лимитов провайдера), результаты приходят одним альбомом.
+
+    После перезапуска бота стили подборки поднимаются из БД как обычные задачи —
+    и доставляются по одному.
+    """
+
+    bot: Bot
+    telegram_id: int
+    chat_id: int
+    jobs: List[PhotoshootJob]
+    progress_message_id: Optional[int] = None
+    tier: str = TIER_FREE
+
+
+GenerationTask = Union[PhotoshootJob, PhotoshootBatch]
+
+
+async def resolve_user_tier(telegram_id: int) -> str:
+    """
+    Уровень пользователя для очереди: админ, оплаченные кредиты фотосессий,
+    рублёвый баланс на фотосессию или «бесплатный».
+    """
+    try:
+        if await is_admin(telegram_id):
+            return TIER_ADMIN
+        user = await get_user_by_telegram_id(telegram_id)
+    except Exception as e:
+        logger.warning("Не удалось определить уровень пользователя %s: %s", telegram_id, e)
+        return TIER_FREE
+
+    if user.photoshoot_credits > 0:
+        return TIER_CREDITS
+    if user.balance >= PHOTOSHOOT_PRICE:
+        return TIER_BALANCE
+    return TIER_FREE
+
+
+async def _save(job: PhotoshootJob, **fields) -> None:
+    """
+    Сохраняет состояние задачи в БД. Сбой записи не должен ломать саму генерацию — только логируем.
+    """
+    if job.job_id is None:
+        return
+    try:
+        await update_generation_job(job.job_id, **fields)
+    except Exception as e:
+        logger.warning("Не удалось обновить задачу генерации #%s: %s", job.job_id, e)
+
+
+async def _edit_progress(job: GenerationTask, text: str, **kwargs) -> None:
+    """
+    Обновляет сообщение «Готовлю…». Не критично, поэтому ошибки только логируем.
+    """
+    try:
+        if job.progress_message_id is None:
+            await job.bot.send_message(chat_id=job.chat_id, text=text, **kwargs)
+            return
+        await job.bot.edit_message_text(
+            text=text,
+            chat_id=job.chat_id,
+            message_id=job.progress_message_id,
+            **kwargs,
+        )
+    except Exception as e:
+        logger.warning("Не удалось обновить сообщение о прогрессе: %s", e)
+
+
+async def _send_upload_action(job: GenerationTask) -> None:
+    try:
+        await job.bot.send_chat_action(chat_id=job.chat_id, action="upload_photo")
+    except Exception as e:
+        logger.warning("Не удалось отправить chat action: %s", e)
+
+
+def _choose_image_size() -> str:
+    """
+    Размер результата под нагрузку (см. quality.py). Провайдеру без imageConfig размер
+    не передаётся: уменьшение ничего не ускорит, а подпись «сделали в 2K» была бы неправдой.
+    """
+    provider = get_provider()
+    if not provider.supports_image_config:
+        return IMAGE_SIZE_DEFAULT
+    return quality_controller.choose(
+        eta_seconds=generation_scheduler.estimate().eta_seconds,
+        p95_seconds=provider.stats.latency_percentile(0.95),
+    )
+
+
+async def _charge(job: PhotoshootJob) -> None:
+    """
+    Списание кредита/баланса — один раз на задачу, даже если её перезапускали.
+
+    Нехватка средств генерацию не останавливает — как и раньше.
+    """
+    if job.charged:
+        return
+    await consume_photoshoot_credit_or_balance(
+        telegram_id=job.telegram_id,
+        price_rub=PHOTOSHOOT_PRICE,
+    )
+    job.charged = True
+    await _save(job, charged=True)
+
+
+async def _log_result(job: PhotoshootJob, status: PhotoshootStatus, error_message: Optional[str] = None) -> None:
+    await log_photoshoot(
+        telegram_id=job.telegram_id,
+        style_title=job.style_title,
+        status=status,
+        cost_rub=0,  # пока не списываем деньги
+        cost_credits=0,  # и кредиты тоже
+        provider="comet_gemini_2_5_flash",
+        error_message=error_message,
+    )
+
+
+def _ready_output(job: PhotoshootJob) -> Optional[Tuple[StoredOutput, str]]:
+    """
+    Результат, который уже есть, и его размер: готов до перезапуска, но не доставлен
+    (тогда его digest — job.result_digest), или такой же лежит в кеше.
+    """
+    if job.result_digest:
+        ready_photo = get_output_store().get(job.result_digest)
+        if ready_photo is not None:
+            return ready_photo, job.image_size
+    if job.force_regenerate:
+        return None
+    return find_cached_photoshoot(
+        style_title=job.style_title,
+        style_prompt=job.style_prompt,
+        user_photo_file_ids=job.file_ids,
+        user_photo_file_unique_ids=job.file_unique_ids,
+    )
+
+
+async def _send_final(
+    job: PhotoshootJob,
+    photo: StoredOutput,
+    preview_message: Optional[Message],
+    variants: Sequence[StoredOutput] = (),
+) -> None:
+    """
+    Финальное фото: обычным сообщением, а если уже показали превью — заменяя его
+    или отдельным документом (см. GENERATION_PROGRESSIVE_DELIVERY).
+    Несколько вариантов из одного запроса — одним альбомом.
+    """
+    caption = photo_caption(job.image_size)
+    mode = settings.GENERATION_PROGRESSIVE_DELIVERY
+
+    if variants:
+        await send_output_media_group(
+            job.bot,
+            job.chat_id,
+            [photo, *variants],
+            captions=[f"{caption}\nВариантов: {len(variants) + 1}"] + [None] * len(variants),
+        )
+        return
+
+    if preview_message is not None and mode == PROGRESSIVE_EDIT:
+        try:
+            await edit_output_photo(preview_message, photo, caption=caption)
+            return
+        except Exception as e:
+            logger.warning("Не удалось заменить превью финальным фото: %s", e)
+
+    if preview_message is not None and mode == PROGRESSIVE_DOCUMENT:
+        await send_output_document(job.bot, job.chat_id, photo, caption=caption)
+        return
+
+    await send_output_photo(job.bot, job.chat_id, photo, caption=caption)
+
+
+async def _deliver(
+    job: PhotoshootJob,
+    photo: StoredOutput,
+    text: str,
+    preview_message: Optional[Message] = None,
+    variants: Sequence[StoredOutput] = (),
+) -> None:
+    if job.result_digest != photo.digest:
+        job.result_digest = photo.digest
+        await _save(job, status=GenerationJobStatus.succeeded, result_digest=photo.digest)
+
+    await _send_final(job, photo, preview_message, variants)
+    await _save(job, status=GenerationJobStatus.delivered)
+    await _edit_progress(job, text, reply_markup=get_after_photoshoot_keyboard())
+
+
+async def run_photoshoot_job(job: PhotoshootJob) -> bool:
+    """
+    Выполняется воркером планировщика: списание, ровно один запрос к провайдеру
+    (или готовый результат из кеша), доставка и запись в лог.
+    Задача, поднятая из БД после перезапуска, не списывается повторно,
+    а уже готовый результат просто доставляется.
+    Возвращает True, если фото сгенерировано провайдером (для оценки длительности в планировщике).
+    """
+    if job.job_id is not None:
+        await start_generation_job_attempt(job.job_id)
+
+    ready = _ready_output(job)
+    if ready is not None:
+        ready_photo, image_size = ready
+        # Картинка была готова до перезапуска, но не дошла до пользователя
+        if ready_photo.digest == job.result_digest:
+            await _deliver(job, ready_photo, "Создать ещё одну фотосессию?")
+            return False
+
+        # Пока заявка ждала, такой же результат мог появиться в кеше — отдаём без списания
+        job.image_size = image_size
+        await _save(job, image_size=image_size)
+        await _deliver(
+            job,
+            ready_photo,
+            "Это фото в этом стиле уже было готово — повторно не списываем 🙌\n"
+            "Хочешь другой вариант? Нажми «🔄 Другой вариант в этом стиле».",
+        )
+        return False
+
+    # Размер под текущую нагрузку: длинная очередь или медленный провайдер — 2K/1K вместо 4K
+    job.image_size = _choose_image_size()
+    await _save(job, image_size=job.image_size)
+
+    # Фото начинаем качать сразу — параллельно со списанием
+    input_photos_task = asyncio.create_task(
+        download_input_photos(job.bot, job.file_ids, job.file_unique_ids)
+    )
+
+    # списание кредита/баланса как раньше (один раз на задачу, даже если её перезапускали)
+    try:
+        await _charge(job)
+    except BaseException:
+        input_photos_task.cancel()
+        raise
+
+    await _edit_progress(
+        job,
+        f"Готовлю твою фотосессию в стиле «{job.style_title}»… ⏳\n"
+        "Обычно это занимает 15–30 секунд.",
+    )
+
+    # Двухфазный режим: превью 1K показываем, как только оно готово; финальное фото — потом
+    preview_message: Optional[Message] = None
+
+    async def _show_preview(preview: StoredOutput) -> None:
+        nonlocal preview_message
+        preview_message = await send_output_photo(
+            job.bot,
+            job.chat_id,
+            preview,
+            caption=f"Вот быстрый черновик 👀\nФото в {job.image_size} будет готово чуть позже…",
+        )
+
+    progressive = settings.GENERATION_PROGRESSIVE_DELIVERY in (PROGRESSIVE_EDIT, PROGRESSIVE_DOCUMENT)
+    variants: List[StoredOutput] = []
+
+    try:
+        _, input_photos = await asyncio.gather(
+            _send_upload_action(job),
+            input_photos_task,
+        )
+        if job.candidates > 1:
+            # несколько вариантов одним запросом — загрузка фото и промпт на всех одни
+            generated_photo, *variants = await generate_photoshoot_variants(
+                style_title=job.style_title,
+                style_prompt=job.style_prompt,
+                user_photo_file_ids=job.file_ids,
+                bot=job.bot,
+                input_photos=input_photos,
+                user_photo_file_unique_ids=job.file_unique_ids,
+                force_regenerate=job.force_regenerate,
+                image_size=job.image_size,
+                count=job.candidates,
+            )
+        else:
+            generated_photo = await generate_photoshoot_image(
+                style_title=job.style_title,
+                style_prompt=job.style_prompt,
+                user_photo_file_ids=job.file_ids,
+                bot=job.bot,
+                input_photos=input_photos,
+                user_photo_file_unique_ids=job.file_unique_ids,
+                force_regenerate=job.force_regenerate,
+                image_size=job.image_size,
+                on_preview=_show_preview if progressive else None,
+            )
+    except Exception as e:
+        input_photos_task.cancel()
+        # Логируем неудачу
+        await _log_result(job, PhotoshootStatus.failed, error_message=str(e))
+        await _save(job, status=GenerationJobStatus.failed, error_message=str(e))
+        await _edit_progress(job, FAILED_TEXT)
+        return False
+
+    await _deliver(
+        job,
+        generated_photo,
+        "Создать ещё одну фотосессию?",
+        preview_message=preview_message,
+        variants=variants,
+    )
+
+    # Логируем успешную фотосессию
+    await _log_result(job, PhotoshootStatus.success)
+    return True
+
+
+async def run_photoshoot_batch(batch: PhotoshootBatch) -> bool:
+    """
+    Подборка стилей: уже готовые стили берутся как есть (без списания), остальные списываются
+    по отдельности и генерируются параллельно из одних подготовленных фото.
+    Удачные результаты — одним альбомом; неудача одного стиля не мешает остальным.
+    """
+    for job in batch.jobs:
+        if job.job_id is not None:
+            await start_generation_job_attempt(job.job_id)
+
+    outputs: Dict[int, StoredOutput] = {}
+    for index, job in enumerate(batch.jobs):
+        ready = _ready_output(job)
+        if ready is not None:
+            outputs[index] = ready[0]
+
+    pending = [index for index in range(len(batch.jobs)) if index not in outputs]
+    generated: List[int] = []
+    failed: List[PhotoshootJob] = []
+
+    if pending:
+        # Размер один на всю подборку — по текущей нагрузке (см. quality.py)
+        image_size = _choose_image_size()
+
+        # Селфи одно на все стили — качаем один раз, параллельно со списанием
+        first = batch.jobs[pending[0]]
+        input_photos_task = asyncio.create_task(
+            download_input_photos(batch.bot, first.file_ids, first.file_unique_ids)
+        )
+        try:
+            for index in pending:
+                job = batch.jobs[index]
+                job.image_size = image_size
+                await _save(job, image_size=image_size)
+                await _charge(job)
+        except BaseException:
+            input_photos_task.cancel()
+            raise
+
+        titles = ", ".join(f"«{batch.jobs[index].style_title}»" for index in pending)
+        await _edit_progress(
+            batch,
+            f"Готовлю подборку: {titles}… ⏳\n"
+            "Стили делаю одновременно — это займёт примерно как одна фотосессия.",
+        )
+
+        try:
+            _, input_photos = await asyncio.gather(
+                _send_upload_action(batch),
+                input_photos_task,
+            )
+            # предобработка и base64 — тоже один раз на все стили
+            prepared = await prepare_input_photos(input_photos, encode=len(pending) > 1)
+        except Exception as e:
+            input_photos_task.cancel()
+            results: List[object] = [e] * len(pending)
+        else:
+            results = await asyncio.gather(
+                *(
+                    generate_photoshoot_image(
+                        style_title=batch.jobs[index].style_title,
+                        style_prompt=batch.jobs[index].style_prompt,
+                        user_photo_file_ids=batch.jobs[index].file_ids,
+                        bot=batch.bot,
+                        user_photo_file_unique_ids=batch.jobs[index].file_unique_ids,
+                        force_regenerate=batch.jobs[index].force_regenerate,
+                        image_size=image_size,
+                        prepared_photos=prepared,
+                    )
+                    for index in pending
+                ),
+                return_exceptions=True,
+            )
+
+        for index, result in zip(pending, results):
+            job = batch.jobs[index]
+            if isinstance(result, BaseException):
+                await _log_result(job, PhotoshootStatus.failed, error_message=str(result))
+                await _save(job, status=GenerationJobStatus.failed, error_message=str(result))
+                failed.append(job)
+                continue
+            outputs[index] = result
+            generated.append(index)
+
+    if not outputs:
+        await _edit_progress(batch, FAILED_TEXT)
+        return False
+
+    delivered = [(batch.jobs[index], outputs[index]) for index in sorted(outputs)]
+    for job, photo in delivered:
+        if job.result_digest != photo.digest:
+            job.result_digest = photo.digest
+            await _save(job, status=GenerationJobStatus.succeeded, result_digest=photo.digest)
+
+    await send_output_media_group(
+        batch.bot,
+        batch.chat_id,
+        [photo for _, photo in delivered],
+        captions=[f"<b>{job.style_title}</b>" for job, _ in delivered],
+    )
+    for job, _ in delivered:
+        await _save(job, status=GenerationJobStatus.delivered)
+
+    text = "Готово! Вот твоя подборка ✨\n"
+    if failed:
+        text += (
+            "Не получилось в стилях: "
+            + ", ".join(f"«{job.style_title}»" for job in failed)
+            + " 😔\n"
+        )
+    await _edit_progress(batch, text + "Создать ещё одну фотосессию?", reply_markup=get_after_photoshoot_keyboard())
+
+    # Логируем каждый стиль отдельно
+    for index in generated:
+        await _log_result(batch.jobs[index], PhotoshootStatus.success)
+    return bool(generated)
+
+
+async def run_generation_job(job: GenerationTask) -> bool:
+    if isinstance(job, PhotoshootBatch):
+        return await run_photoshoot_batch(job)
+    return await run_photoshoot_job(job)
+
+
+async def on_photoshoot_job_error(job: GenerationTask, exc: BaseException) -> None:
+    """
+    Заявку вытеснила/отклонила защита «одна генерация на пользователя» — показываем причину;
+    таймаут и прочие ошибки — общее сообщение.
+    """
+    error_message = str(exc) or type(exc).__name__
+    for sub_job in job.jobs if isinstance(job, PhotoshootBatch) else [job]:
+        await _save(sub_job, status=GenerationJobStatus.failed, error_message=error_message)
+    if isinstance(exc, (GenerationInProgress, GenerationReplaced)):
+        await _edit_progress(job, str(exc))
+        return
+    await _edit_progress(job, FAILED_TEXT)
+
+
+generation_scheduler = GenerationScheduler(
+    run_job=run_generation_job,
+    on_error=on_photoshoot_job_error,
+    guard=user_generation_guard,
+    workers=settings.GENERATION_WORKERS,
+    max_queue=settings.GENERATION_QUEUE_MAX,
+    job_timeout=settings.GENERATION_JOB_TIMEOUT_SECONDS,
+    tier_weights=settings.GENERATION_TIER_WEIGHTS,
+    max_eta_seconds=settings.GENERATION_ADMISSION_MAX_ETA_SECONDS,
+    default_job_seconds=settings.GENERATION_DEFAULT_JOB_SECONDS,
+    min_job_samples=settings.GENERATION_MIN_JOB_SAMPLES,
+)
+
+
+def format_eta(seconds: float) -> str:
+    minutes = round(seconds / 60)
+    if minutes < 1:
+        return "меньше минуты"
+    return f"около {minutes} мин"
+
+
+async def _create_job_row(job: PhotoshootJob) -> None:
+    row = await create_generation_job(
+        telegram_id=job.telegram_id,
+        chat_id=job.chat_id,
+        style_id=job.style_id,
+        style_title=job.style_title,
+        style_prompt=job.style_prompt,
+        file_ids=job.file_ids,
+        file_unique_ids=job.file_unique_ids,
+        force_regenerate=job.force_regenerate,
+        progress_message_id=job.progress_message_id,
+    )
+    job.job_id = row.id
+
+
+async def enqueue_photoshoot_job(job: PhotoshootJob) -> Admission:
+    """
+    Сохраняет заявку в БД и ставит её в очередь. Возвращает позицию и оценку времени готовности.
+    QueueFull / AdmissionRejected — заявку не приняли (оплата не списана, в БД ничего не пишем).
+    """
+    generation_scheduler.check_admission(job.telegram_id)
+
+    await _create_job_row(job)
+    job.tier = await resolve_user_tier(job.telegram_id)
+
+    try:
+        # допуск уже проверен выше; здесь только жёсткий лимит очереди
+        return generation_scheduler.submit(job, job.telegram_id, tier=job.tier, admit=False)
+    except QueueFull as e:
+        await _save(job, status=GenerationJobStatus.failed, error_message=str(e))
+        raise
+
+
+async def enqueue_photoshoot_batch(batch: PhotoshootBatch) -> Admission:
+    """
+    То же для подборки: запись в БД на каждый стиль, в очереди — одна заявка
+    весом в число стилей (генерации у провайдера идут параллельно).
+    """
+    generation_scheduler.check_admission(batch.telegram_id, len(batch.jobs))
+
+    for job in batch.jobs:
+        await _create_job_row(job)
+    batch.tier = await resolve_user_tier(batch.telegram_id)
+
+    try:
+        return generation_scheduler.submit(
+            batch, batch.telegram_id, tier=batch.tier, admit=False, weight=len(batch.jobs)
+        )
+    except QueueFull as e:
+        for job in batch.jobs:
+            await _save(job, status=GenerationJobStatus.failed, error_message=str(e))
+        raise
+
+
+async def recover_generation_jobs(bot: Bot) -> int:
+    """
+    Вызывается при старте: возвращает в очередь задачи, оборванные перезапуском,
+    и доставляет готовые, но не отправленные результаты. Возвращает число поднятых задач.
+    """
+    rows = await get_unfinished_generation_jobs()
+    recovered = 0
+
+    for row in rows:
+        job = PhotoshootJob.from_row(bot, row)
+
+        if row.status != GenerationJobStatus.succeeded and row.attempts >= settings.GENERATION_JOB_MAX_ATTEMPTS:
+            await _save(job, status=GenerationJobStatus.failed, error_message="Превышено число попыток")
+            await _edit_progress(job, FAILED_TEXT)
+            continue
+
+        # оплата по таким задачам уже прошла — ставим их не ниже уровня «кредиты»
+        job.tier = await resolve_user_tier(job.telegram_id)
+        if job.charged and job.tier in (TIER_BALANCE, TIER_FREE):
+            job.tier = TIER_CREDITS
+
+        try:
+            generation_scheduler.submit(job, job.telegram_id, tier=job.tier, admit=False)
+        except QueueFull as e:
+            await _save(job, status=GenerationJobStatus.failed, error_message=str(e))
+            await _edit_progress(job, FAILED_TEXT)
+            continue
+
+        recovered += 1
+        if row.status != GenerationJobStatus.succeeded:
+            await _edit_progress(
+                job,
+                "Бот перезапускался — продолжаю твою фотосессию, повторно не списываем ⏳",
+            )
+
+    if rows:
+        logger.info("Восстановление задач генерации: найдено %s, возвращено в очередь %s", len(rows), recovered)
+    return recovered
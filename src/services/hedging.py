@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from src.config import settings
+from src.services.providers import ProviderStats
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Hedger:
+    """
+    Хеджирование медленных запросов: если первая попытка не ответила за «обычное» время
+    (перцентиль недавних задержек провайдера), параллельно запускаем вторую —
+    берём того, кто ответит первым, проигравшего отменяем.
+
+    Бюджет: дополнительных запросов не больше budget_percent от числа запросов,
+    прошедших через хеджер, — иначе при общей деградации провайдера удвоили бы нагрузку и расходы.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float,
+        min_samples: int,
+        default_delay: float,
+        budget_percent: float,
+    ) -> None:
+        self.name = name
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.budget_percent = budget_percent
+
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    def delay_for(self, stats: ProviderStats) -> float:
+        """
+        Через сколько секунд запускать вторую попытку; пока статистики мало — default_delay.
+        """
+        if stats.latency_samples < self.min_samples:
+            return self.default_delay
+        latency = stats.latency_percentile(self.percentile)
+        return latency if latency is not None else self.default_delay
+
+    def _within_budget(self) -> bool:
+        return self.hedged + 1 <= self.requests * self.budget_percent / 100.0
+
+    async def run(
+        self,
+        primary: Callable[[], Awaitable[T]],
+        backup: Callable[[], Awaitable[T]],
+        delay: float,
+    ) -> T:
+        """
+        Выполняет primary; если за delay секунд ответа нет и бюджет позволяет — ещё и backup.
+        Результат — первый успешный; если упали обе — ошибка primary.
+        """
+        self.requests += 1
+        first: "asyncio.Future[T]" = asyncio.ensure_future(primary())
+        second: Optional["asyncio.Future[T]"] = None
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                return first.result()
+
+            if not self._within_budget():
+                self.denied += 1
+                return await first
+
+            self.hedged += 1
+            logger.info("%s: нет ответа за %.1f с — запускаем вторую попытку", self.name, delay)
+            second = asyncio.ensure_future(backup())
+
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+            return first.result()
+        finally:
+            for task in (first, second):
+                if task is None:
+                    continue
+                if not task.done():
+                    # проигравший (или обе попытки, если отменили нас самих)
+                    task.cancel()
+                elif not task.cancelled():
+                    # исключение проигравшего никому не нужно — помечаем прочитанным
+                    task.exception()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "denied": self.denied,
+        }
+
+
+generation_hedger = Hedger(
+    name="generation",
+    percentile=settings.GENERATION_HEDGE_PERCENTILE,
+    min_samples=settings.GENERATION_HEDGE_MIN_SAMPLES,
+    default_delay=settings.GENERATION_HEDGE_DEFAULT_DELAY_SECONDS,
+    budget_percent=settings.GENERATION_HEDGE_BUDGET_PERCENT,
+)
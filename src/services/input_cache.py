@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from src.config import settings
+
+
+class InputPhotoCache:
+    """
+    Кеш входных фото из Telegram.
+
+    - Байты фото: LRU по file_unique_id с ограничением по объёму
+      (повторная попытка / другой стиль с тем же селфи не качают фото заново).
+    - Результат bot.get_file: file_id -> (file_path, file_unique_id) на время жизни ссылки
+      (Telegram гарантирует file_path минимум на час).
+    """
+
+    def __init__(self, max_bytes: int, file_path_ttl: float) -> None:
+        self.max_bytes = max_bytes
+        self.file_path_ttl = file_path_ttl
+
+        self._photos: "OrderedDict[str, bytes]" = OrderedDict()
+        self._total_bytes = 0
+        self._files: Dict[str, Tuple[str, Optional[str], float]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- байты ----------
+
+    def get_photo(self, file_unique_id: str) -> Optional[bytes]:
+        data = self._photos.get(file_unique_id)
+        if data is None:
+            self.misses += 1
+            return None
+        self._photos.move_to_end(file_unique_id)
+        self.hits += 1
+        return data
+
+    def put_photo(self, file_unique_id: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+
+        old = self._photos.pop(file_unique_id, None)
+        if old is not None:
+            self._total_bytes -= len(old)
+
+        self._photos[file_unique_id] = data
+        self._total_bytes += len(data)
+
+        while self._total_bytes > self.max_bytes:
+            _, evicted = self._photos.popitem(last=False)
+            self._total_bytes -= len(evicted)
+
+    # ---------- file_path ----------
+
+    def get_file(self, file_id: str) -> Optional[Tuple[str, Optional[str]]]:
+        item = self._files.get(file_id)
+        if item is None:
+            return None
+        file_path, file_unique_id, expires_at = item
+        if expires_at < time.monotonic():
+            self._files.pop(file_id, None)
+            return None
+        return file_path, file_unique_id
+
+    def put_file(self, file_id: str, file_path: str, file_unique_id: Optional[str]) -> None:
+        now = time.monotonic()
+        if len(self._files) >= settings.INPUT_FILE_PATH_CACHE_SIZE:
+            # чистим протухшие; если не помогло — самые старые записи
+            self._files = {k: v for k, v in self._files.items() if v[2] >= now}
+            while len(self._files) >= settings.INPUT_FILE_PATH_CACHE_SIZE:
+                self._files.pop(next(iter(self._files)))
+        self._files[file_id] = (file_path, file_unique_id, now + self.file_path_ttl)
+
+    def unique_id_for(self, file_id: str) -> Optional[str]:
+        item = self.get_file(file_id)
+        return item[1] if item else None
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "photos": len(self._photos),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "file_paths": len(self._files),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+input_photo_cache = InputPhotoCache(
+    max_bytes=settings.INPUT_PHOTO_CACHE_MAX_BYTES,
+    file_path_ttl=settings.INPUT_FILE_PATH_TTL_SECONDS,
+)
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional
+
+from src.config import settings
+from src.db import get_provider_api_keys, set_provider_api_key_active
+from src.services.providers import (
+    ERROR_AUTH,
+    ERROR_CIRCUIT_OPEN,
+    ERROR_NO_KEYS,
+    ERROR_QUOTA,
+    ERROR_RATE_LIMIT,
+    ProviderError,
+    all_providers,
+    get_provider,
+    provider_error,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# После этих ошибок ключ на время выводится из ротации (другие ключи продолжают работать)
+COOLDOWN_ERRORS = (ERROR_AUTH, ERROR_QUOTA, ERROR_RATE_LIMIT)
+
+# Окно для лимита запросов в секунду
+RPS_WINDOW_SECONDS = 1.0
+
+
+def mask_key(api_key: str) -> str:
+    """
+    Ключ для показа в админке и логах: начало и конец.
+    """
+    if len(api_key) <= 10:
+        return api_key[:2] + "…"
+    return f"{api_key[:5]}…{api_key[-4:]}"
+
+
+class _KeyState:
+    def __init__(self, api_key: str) -> None:
+        self.api_key = api_key
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.recent: Deque[float] = deque()
+
+        self.requests = 0
+        self.errors = 0
+        self.last_error_class: Optional[str] = None
+
+
+class ApiKeyPool:
+    """
+    Ключи одного провайдера. Запрос получает наименее загруженный свободный ключ
+    (при равенстве — по кругу). На каждый ключ — лимит одновременных запросов и запросов в секунду;
+    после 401/403/429 ключ отдыхает cooldown_seconds (или Retry-After), остальные работают
+    (429 на единственном ключе — не выключаем, см. lease).
+    Набор ключей меняется на ходу (админка), без перезапуска.
+    """
+
+    def __init__(self, provider: str, max_concurrency: int, rps: float, cooldown_seconds: float) -> None:
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.rps = rps
+        self.cooldown_seconds = cooldown_seconds
+
+        self._keys: "OrderedDict[str, _KeyState]" = OrderedDict()
+        self._next = 0
+        self._released = asyncio.Event()
+
+    # ---------- состав пула ----------
+
+    @property
+    def keys(self) -> List[str]:
+        return list(self._keys)
+
+    def has_keys(self) -> bool:
+        return bool(self._keys)
+
+    def add(self, api_key: str) -> bool:
+        if not api_key or api_key in self._keys:
+            return False
+        self._keys[api_key] = _KeyState(api_key)
+        self._notify()
+        return True
+
+    def remove(self, api_key: str) -> bool:
+        # запросы, уже идущие с этим ключом, доработают; новые его не получат
+        return self._keys.pop(api_key, None) is not None
+
+    # ---------- выдача ключа ----------
+
+    def _notify(self) -> None:
+        self._released.set()
+        self._released = asyncio.Event()
+
+    def _prune(self, state: _KeyState, now: float) -> None:
+        while state.recent and now - state.recent[0] >= RPS_WINDOW_SECONDS:
+            state.recent.popleft()
+
+    def _free_in(self, state: _KeyState, now: float) -> float:
+        """
+        Через сколько секунд ключ можно будет взять (0 — сейчас; inf — ждать освобождения).
+        """
+        if state.cooldown_until > now:
+            return state.cooldown_until - now
+        if self.max_concurrency and state.in_flight >= self.max_concurrency:
+            return float("inf")
+        self._prune(state, now)
+        if self.rps and len(state.recent) >= self.rps:
+            return state.recent[0] + RPS_WINDOW_SECONDS - now
+        return 0.0
+
+    def _pick(self, now: float) -> Optional[_KeyState]:
+        states = list(self._keys.values())
+        start = self._next % len(states)
+        rotated = states[start:] + states[:start]
+        free = [state for state in rotated if self._free_in(state, now) == 0.0]
+        if not free:
+            return None
+        best = min(free, key=lambda state: state.in_flight)
+        self._next = states.index(best) + 1
+        return best
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[str]:
+        """
+        Выдаёт ключ на время одного запроса. Если все ключи отдыхают после ошибок —
+        сразу ProviderRateLimited с retry_after (решение о повторе — за retry.py);
+        если упёрлись в лимиты параллельности/RPS — ждём.
+        """
+        while True:
+            if not self._keys:
+                raise RuntimeError(f"API ключ для провайдера {self.provider} не задан в настройках.")
+
+            now = time.monotonic()
+            state = self._pick(now)
+            if state is not None:
+                break
+
+            cooling = [s.cooldown_until - now for s in self._keys.values() if s.cooldown_until > now]
+            if len(cooling) == len(self._keys):
+                raise provider_error(
+                    "Сервис генерации сейчас перегружен. Попробуй чуть позже 🙏",
+                    ERROR_NO_KEYS,
+                    provider=self.provider,
+                    retry_after=min(cooling),
+                )
+
+            wait = min(self._free_in(s, now) for s in self._keys.values())
+            released = self._released
+            try:
+                await asyncio.wait_for(released.wait(), timeout=None if wait == float("inf") else wait)
+            except asyncio.TimeoutError:
+                pass
+
+        state.in_flight += 1
+        state.requests += 1
+        state.recent.append(now)
+        try:
+            yield state.api_key
+        except ProviderError as e:
+            if e.error_class == ERROR_CIRCUIT_OPEN:
+                # запрос не ушёл (автомат разомкнут) — ключ тут ни при чём
+                raise
+            state.errors += 1
+            state.last_error_class = e.error_class
+            if e.error_class == ERROR_RATE_LIMIT and len(self._keys) == 1:
+                # единственный ключ не выключаем: иначе вся очередь получит no_keys на cooldown_seconds;
+                # повтор подождёт по своей задержке (и Retry-After провайдера, см. retry.py)
+                raise
+            if e.error_class in COOLDOWN_ERRORS:
+                pause = e.retry_after if e.retry_after is not None else self.cooldown_seconds
+                state.cooldown_until = max(state.cooldown_until, time.monotonic() + pause)
+                logger.warning(
+                    "%s: ключ %s отдыхает %.0f с (%s)",
+                    self.provider,
+                    mask_key(state.api_key),
+                    pause,
+                    e.error_class,
+                )
+                if any(s.cooldown_until <= time.monotonic() for s in self._keys.values()):
+                    # беда с этим ключом, а не с провайдером: с другим ключом повтор может пройти
+                    e.retryable = True
+            raise
+        finally:
+            state.in_flight -= 1
+            self._notify()
+
+    @property
+    def stats(self) -> List[Dict[str, object]]:
+        now = time.monotonic()
+        return [
+            {
+                "key": mask_key(state.api_key),
+                "in_flight": state.in_flight,
+                "requests": state.requests,
+                "errors": state.errors,
+                "last_error_class": state.last_error_class,
+                "cooldown_seconds": round(max(0.0, state.cooldown_until - now), 1),
+            }
+            for state in self._keys.values()
+        ]
+
+
+_pools: Dict[str, ApiKeyPool] = {}
+
+
+def get_key_pool(provider_name: str) -> ApiKeyPool:
+    """
+    Пул ключей провайдера; при первом обращении — ключ из настроек провайдера
+    и дополнительные из settings.PROVIDER_API_KEYS.
+    """
+    pool = _pools.get(provider_name)
+    if pool is None:
+        pool = ApiKeyPool(
+            provider=provider_name,
+            max_concurrency=settings.PROVIDER_KEY_MAX_CONCURRENCY,
+            rps=settings.PROVIDER_KEY_RPS,
+            cooldown_seconds=settings.PROVIDER_KEY_COOLDOWN_SECONDS,
+        )
+        pool.add(get_provider(provider_name).api_key() or "")
+        for api_key in settings.PROVIDER_API_KEYS.get(provider_name, []):
+            pool.add(api_key)
+        _pools[provider_name] = pool
+    return pool
+
+
+async def load_api_keys() -> None:
+    """
+    Применяет к пулам изменения из админки, сохранённые в БД (вызывать после init_db).
+    """
+    known = {provider.name for provider in all_providers()}
+    for row in await get_provider_api_keys():
+        if row.provider not in known:
+            continue
+        pool = get_key_pool(row.provider)
+        if row.is_active:
+            pool.add(row.api_key)
+        else:
+            pool.remove(row.api_key)
+
+
+async def add_api_key(provider_name: str, api_key: str) -> bool:
+    added = get_key_pool(provider_name).add(api_key)
+    await set_provider_api_key_active(provider_name, api_key, True)
+    return added
+
+
+async def remove_api_key(provider_name: str, api_key: str) -> bool:
+    removed = get_key_pool(provider_name).remove(api_key)
+    await set_provider_api_key_active(provider_name, api_key, False)
+    return removed
+
+
+async def replace_api_key(provider_name: str, old_key: str, new_key: str) -> None:
+    await add_api_key(provider_name, new_key)
+    await remove_api_key(provider_name, old_key)
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from src.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_codec_executor() -> ThreadPoolExecutor:
+    """
+    Пул потоков для «тяжёлой» работы кодеков (base64, запись файлов),
+    чтобы она не останавливала event loop для остальных пользователей.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.CODEC_THREADS,
+            thread_name_prefix="codec",
+        )
+    return _executor
+
+
+async def run_codec(func: Callable[..., T], *args, size: int) -> T:
+    """
+    Выполняет func(*args) в пуле потоков, если объём работы (size, в байтах)
+    не меньше CODEC_OFFLOAD_THRESHOLD_BYTES. Мелочь выполняем сразу в loop —
+    переключение в поток стоит дороже самой работы.
+    """
+    if size < settings.CODEC_OFFLOAD_THRESHOLD_BYTES:
+        return func(*args)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_codec_executor(), functools.partial(func, *args))
+
+
+def shutdown_codec_executor() -> None:
+    global _executor
+    if _executor is None:
+        return
+    executor, _executor = _executor, None
+    executor.shutdown(wait=True, cancel_futures=True)
+    logger.info("Пул потоков кодеков остановлен")
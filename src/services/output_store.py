@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import FSInputFile
+
+from src.config import settings
+from src.paths import OUTPUT_DIR
+from src.services.offload import get_codec_executor
+
+
+logger = logging.getLogger(__name__)
+
+PENDING_PREFIX = ".pending-"
+PENDING_SUFFIX = ".part"
+
+_MIME_TO_EXT = {
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/jpeg": ".jpg",
+}
+_EXT_TO_MIME = {ext: mime for mime, ext in _MIME_TO_EXT.items()}
+_STORED_NAME_RE = re.compile(r"^([0-9a-f]{64})(\.[a-z]+)$")
+
+
+def ext_for_mime(mime_type: str) -> str:
+    if "png" in mime_type:
+        return ".png"
+    if "webp" in mime_type:
+        return ".webp"
+    return ".jpg"
+
+
+@dataclass(frozen=True)
+class StoredOutput:
+    """
+    Ссылка на сгенерированную картинку в хранилище (ключ — sha256 содержимого).
+    """
+
+    digest: str
+    path: str
+    mime_type: str
+    size: int
+
+    def as_input_file(self, filename: Optional[str] = None) -> FSInputFile:
+        return FSInputFile(self.path, filename=filename or f"photoshoot_{self.digest[:12]}{ext_for_mime(self.mime_type)}")
+
+
+class PendingOutput:
+    """
+    Файл, который ещё пишется: временное имя в каталоге хранилища
+    и sha256 содержимого, считаемый на лету. Подходит как sink для декодера ответа.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = open(path, "wb")
+
+    def write(self, data: bytes) -> int:
+        self._hash.update(data)
+        self._file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class OutputStore:
+    """
+    Хранилище результатов генерации с адресацией по содержимому.
+
+    - Файл сначала пишется под временным именем, затем атомарно переименовывается в <sha256><ext>
+      (параллельные задачи не перетирают друг друга, одинаковый результат хранится один раз).
+    - Общий объём ограничен max_bytes, лишнее вытесняется по LRU.
+    - start() — уборщик: удаляет недописанные/чужие файлы и восстанавливает индекс с диска.
+    """
+
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+        self._index: "OrderedDict[str, StoredOutput]" = OrderedDict()
+        self._total_bytes = 0
+        self.evicted = 0
+
+    # ---------- запуск / уборка ----------
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        entries, removed = await loop.run_in_executor(get_codec_executor(), self._scan)
+
+        self._index.clear()
+        self._total_bytes = 0
+        for entry in entries:
+            self._index[entry.digest] = entry
+            self._total_bytes += entry.size
+
+        await self._evict()
+        logger.info(
+            "Хранилище результатов: %s файлов, %s байт (лимит %s), удалено недописанных: %s",
+            len(self._index),
+            self._total_bytes,
+            self.max_bytes,
+            removed,
+        )
+
+    def _scan(self) -> Tuple[List[StoredOutput], int]:
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        found: List[Tuple[float, StoredOutput]] = []
+        removed = 0
+        for item in self.root.iterdir():
+            if not item.is_file():
+                continue
+            if item.name.startswith(PENDING_PREFIX):
+                # недописанные файлы после падения — точно наши, удаляем
+                try:
+                    item.unlink()
+                    removed += 1
+                except OSError as e:
+                    logger.warning("Не удалось удалить %s: %s", item, e)
+                continue
+
+            match = _STORED_NAME_RE.match(item.name)
+            if match is None or match.group(2) not in _EXT_TO_MIME:
+                # OUTPUT_STORE_DIR может оказаться общим каталогом — чужие файлы не трогаем
+                logger.warning("Хранилище результатов: посторонний файл %s, пропускаем", item)
+                continue
+
+            st = item.stat()
+            found.append(
+                (
+                    st.st_mtime,
+                    StoredOutput(
+                        digest=match.group(1),
+                        path=str(item),
+                        mime_type=_EXT_TO_MIME[match.group(2)],
+                        size=st.st_size,
+                    ),
+                )
+            )
+
+        # старые (давно не трогали) — в начало LRU
+        found.sort(key=lambda x: x[0])
+        return [entry for _, entry in found], removed
+
+    # ---------- запись ----------
+
+    def open_pending(self) -> PendingOutput:
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=PENDING_PREFIX, suffix=PENDING_SUFFIX, dir=self.root)
+        os.close(fd)
+        return PendingOutput(path)
+
+    def discard(self, pending: PendingOutput) -> None:
+        pending.close()
+        try:
+            os.remove(pending.path)
+        except OSError:
+            pass
+
+    async def commit(self, pending: PendingOutput, mime_type: str) -> StoredOutput:
+        """
+        Закрывает файл и атомарно переименовывает его в <sha256><ext>.
+        """
+        digest = pending.digest
+        ext = ext_for_mime(mime_type)
+        final_path = str(self.root / f"{digest}{ext}")
+
+        def _finish() -> None:
+            pending.close()
+            os.replace(pending.path, final_path)
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(get_codec_executor(), _finish)
+
+        return await self._register(
+            StoredOutput(digest=digest, path=final_path, mime_type=_EXT_TO_MIME[ext], size=pending.size)
+        )
+
+    async def put_bytes(self, data: bytes, mime_type: str) -> StoredOutput:
+        pending = self.open_pending()
+
+        def _write() -> None:
+            pending.write(data)
+
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(get_codec_executor(), _write)
+        except BaseException:
+            self.discard(pending)
+            raise
+        return await self.commit(pending, mime_type)
+
+    async def _register(self, entry: StoredOutput) -> StoredOutput:
+        old = self._index.pop(entry.digest, None)
+        if old is not None:
+            self._total_bytes -= old.size
+            if old.path != entry.path:
+                # тот же контент, но другой mime/расширение — старый файл больше не нужен
+                await self._remove_files([old.path])
+
+        self._index[entry.digest] = entry
+        self._total_bytes += entry.size
+        await self._evict(keep=entry.digest)
+        return entry
+
+    # ---------- чтение / вытеснение ----------
+
+    def get(self, digest: str) -> Optional[StoredOutput]:
+        """
+        Находит результат по sha256 и отмечает его как недавно использованный.
+        """
+        entry = self._index.get(digest)
+        if entry is None:
+            return None
+        if not os.path.exists(entry.path):
+            self._index.pop(digest, None)
+            self._total_bytes -= entry.size
+            return None
+
+        self._index.move_to_end(digest)
+        try:
+            os.utime(entry.path)
+        except OSError:
+            pass
+        return entry
+
+    async def _evict(self, keep: Optional[str] = None) -> None:
+        victims: List[str] = []
+        for digest in list(self._index):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            entry = self._index.pop(digest)
+            self._total_bytes -= entry.size
+            victims.append(entry.path)
+
+        if victims:
+            self.evicted += len(victims)
+            await self._remove_files(victims)
+            logger.info("Хранилище результатов: вытеснено %s файлов по LRU", len(victims))
+
+    async def _remove_files(self, paths: List[str]) -> None:
+        def _remove() -> None:
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(get_codec_executor(), _remove)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "files": len(self._index),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "evicted": self.evicted,
+        }
+
+
+_store: Optional[OutputStore] = None
+
+
+def get_output_store() -> OutputStore:
+    global _store
+    if _store is None:
+        _store = OutputStore(
+            root=Path(settings.OUTPUT_STORE_DIR) if settings.OUTPUT_STORE_DIR else OUTPUT_DIR,
+            max_bytes=settings.OUTPUT_STORE_MAX_BYTES,
+        )
+    return _store
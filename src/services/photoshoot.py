@@ -1,34 +1,85 @@
 from __future__ import annotations
 
-import base64
+import asyncio
+import json
 import logging
-import os
 import re
-import ssl
-import tempfile
-from typing import Optional, List, Sequence, Union
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, List, Sequence, Tuple, Union
 
 import aiohttp
-import certifi
 from aiogram import Bot
-from aiogram.types import FSInputFile
 
 from src.config import settings
+from src.services.genai_stream import (
+    InlineImageStreamDecoder,
+    ResponseTooLargeError,
+    StreamDecodeError,
+    StreamingJsonBody,
+    blob_placeholder,
+    encode_blobs,
+)
+from src.services.input_cache import input_photo_cache
+from src.services.offload import run_codec
+from src.services.output_store import PendingOutput, StoredOutput, get_output_store
+from src.services.preprocess import preprocess_photos
+from src.services.circuit_breaker import get_breaker, get_limit
+from src.services.hedging import generation_hedger
+from src.services.key_pool import get_key_pool
+from src.services.provider_client import get_provider_client
+from src.services.quality import IMAGE_SIZES
+from src.services.providers import (
+    ERROR_BAD_RESPONSE,
+    ERROR_NO_IMAGE,
+    ERROR_NETWORK,
+    ERROR_TIMEOUT,
+    GenerationProvider,
+    ProviderError,
+    get_provider,
+    provider_error,
+)
+from src.services.retry import deadline_remaining, generation_retry, parse_retry_after
+from src.services.result_cache import result_cache, result_cache_key
+from src.services.single_flight import SingleFlight
 
 
 logger = logging.getLogger(__name__)
 
-# Провайдер (APIYI)
-APIYI_BASE_URL = "https://api.apiyi.com"
+# Ограничение по твоему требованию
+MAX_INPUT_PHOTOS = 3
 
-# Модель по умолчанию: поддержка 1K/2K/4K (обычно)
-APIYI_MODEL_NAME_DEFAULT = "gemini-3-pro-image-preview"
+# Параметры картинки, которые просим у модели (входят в ключ кеша результатов)
+IMAGE_SIZE_DEFAULT = "4K"
+ASPECT_RATIO_DEFAULT = "3:4"
 
-# 4K может занимать дольше
-DEFAULT_TIMEOUT_SECONDS = 360
+# Быстрое превью в двухфазном режиме (on_preview в generate_photoshoot_image)
+PREVIEW_IMAGE_SIZE = "1K"
 
-# Ограничение по твоему требованию
-MAX_INPUT_PHOTOS = 3
+# Читаем ответ провайдера кусками (4K-картинка в base64 — это десятки МБ)
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+# Кодирование входных фото в пуле потоков идёт кусками такого размера (исходных байт)
+REQUEST_OFFLOAD_CHUNK_BYTES = 768 * 1024
+
+# Тело ответа с ошибкой читаем не целиком, а только начало (для логов и error.message)
+ERROR_BODY_LIMIT = 64 * 1024
+
+# Общий на процесс лимит одновременных скачиваний фото из Telegram
+_download_semaphore = asyncio.Semaphore(settings.TELEGRAM_DOWNLOAD_CONCURRENCY)
+
+# Одинаковые генерации, запрошенные одновременно, идут к провайдеру один раз
+# (ключ — как у кеша результатов); счётчики — generation_flights.stats
+generation_flights: SingleFlight[List[StoredOutput]] = SingleFlight("generate_photoshoot_image")
+
+
+def photo_caption(image_size: str = IMAGE_SIZE_DEFAULT) -> str:
+    """
+    Подпись к готовому фото: 4K обещаем, только если его и просили.
+    """
+    if image_size == IMAGE_SIZE_DEFAULT:
+        return "Готово! Вот твоё фото в 4K качестве ✨"
+    return f"Готово! Вот твоё фото ✨\nСейчас много желающих — сделали в {image_size}, чтобы не заставлять тебя ждать."
 
 
 def _detect_mime_type(image_bytes: bytes) -> str:
@@ -96,22 +147,50 @@ def _normalize_input_file_ids(
     return uniq
 
 
-def _safe_slug(value: str, max_len: int = 80) -> str:
-    """
-    Безопасный кусок для имени файла (temp).
-    """
-    s = re.sub(r"[^0-9A-Za-z_-]+", "_", value).strip("_")
-    if not s:
-        s = "img"
-    return s[:max_len]
-
-
-async def _download_telegram_photo(bot: Bot, file_id: str) -> bytes:
+async def _download_telegram_photo(
+    bot: Bot,
+    file_id: str,
+    file_unique_id: Optional[str] = None,
+) -> bytes:
     """
     Скачивает фото из Telegram по file_id и возвращает байты.
+    Байты кешируются по file_unique_id, а file_path от get_file — на время жизни ссылки,
+    поэтому повторная генерация с тем же селфи не ходит в Telegram вообще.
     """
+    unique_id = file_unique_id or input_photo_cache.unique_id_for(file_id)
+    if unique_id:
+        cached = input_photo_cache.get_photo(unique_id)
+        if cached is not None:
+            return cached
+
+    cached_file = input_photo_cache.get_file(file_id)
+    if cached_file is not None:
+        try:
+            data = await _fetch_telegram_file(bot, cached_file[0])
+        except Exception as e:
+            # ссылка могла протухнуть раньше срока — спросим get_file заново
+            logger.warning("Не удалось скачать по сохранённому file_path (%s), повторяем get_file", e)
+        else:
+            input_photo_cache.put_photo(unique_id or cached_file[1] or file_id, data)
+            return data
+
     tg_file = await bot.get_file(file_id)
-    stream = await bot.download_file(tg_file.file_path)
+    input_photo_cache.put_file(file_id, tg_file.file_path, tg_file.file_unique_id)
+
+    # тот же файл мог прийти с другим file_id (пользователь переслал то же селфи)
+    unique_id = unique_id or tg_file.file_unique_id
+    if unique_id:
+        cached = input_photo_cache.get_photo(unique_id)
+        if cached is not None:
+            return cached
+
+    data = await _fetch_telegram_file(bot, tg_file.file_path)
+    input_photo_cache.put_photo(unique_id or file_id, data)
+    return data
+
+
+async def _fetch_telegram_file(bot: Bot, file_path: str) -> bytes:
+    stream = await bot.download_file(file_path)
 
     if hasattr(stream, "read"):
         return stream.read()
@@ -119,6 +198,62 @@ async def _download_telegram_photo(bot: Bot, file_id: str) -> bytes:
     return stream
 
 
+async def download_input_photos(
+    bot: Bot,
+    file_ids: Sequence[str],
+    file_unique_ids: Optional[Sequence[Optional[str]]] = None,
+) -> List[bytes]:
+    """
+    Скачивает 1..3 фото из Telegram параллельно (под общим лимитом на процесс).
+    Порядок результата совпадает с порядком file_ids.
+    file_unique_ids (если известны, например из message.photo) — ключи кеша входных фото.
+    Если одно скачивание упало — остальные отменяются.
+    """
+    unique_ids = list(file_unique_ids or [])
+    unique_ids += [None] * (len(file_ids) - len(unique_ids))
+
+    async def _download(fid: str, unique_id: Optional[str]) -> bytes:
+        async with _download_semaphore:
+            return await _download_telegram_photo(bot, fid, unique_id)
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(_download(fid, unique_id))
+                for fid, unique_id in zip(file_ids, unique_ids)
+            ]
+    except Exception as e:
+        logger.exception("Ошибка при скачивании фото из Telegram: %s", e)
+        raise RuntimeError("Не удалось скачать фото из Telegram") from e
+
+    return [t.result() for t in tasks]
+
+
+@dataclass(frozen=True)
+class PreparedPhotos:
+    """
+    Входные фото, готовые к запросу: после предобработки и (если encoded_blobs) уже в base64.
+    Одни на несколько генераций (стили одной подборки) — обработка и кодирование один раз.
+    """
+
+    photos_bytes: List[bytes]
+    encoded_blobs: Optional[List[bytes]] = None
+
+
+async def prepare_input_photos(photos_bytes: Sequence[bytes], encode: bool = True) -> PreparedPhotos:
+    processed = await preprocess_photos(list(photos_bytes))
+    encoded = await encode_blobs(processed, run_codec=run_codec) if encode else None
+    return PreparedPhotos(photos_bytes=processed, encoded_blobs=encoded)
+
+
+async def _read_error_body(resp: aiohttp.ClientResponse) -> str:
+    """
+    Читает начало тела ответа с ошибкой (не больше ERROR_BODY_LIMIT байт).
+    """
+    raw = await resp.content.read(ERROR_BODY_LIMIT)
+    return raw.decode(resp.charset or "utf-8", errors="replace")
+
+
 def _build_prompt(style_title: str, style_prompt: Optional[str]) -> str:
     """
     Формируем итоговый текст промпта.
@@ -139,15 +274,93 @@ def _build_prompt(style_title: str, style_prompt: Optional[str]) -> str:
     )
 
 
+def _input_cache_ids(file_ids: Sequence[str], file_unique_ids: Optional[Sequence[str]]) -> List[str]:
+    """
+    Идентификаторы входных фото для ключа кеша: file_unique_id (одинаков для повторно
+    присланного фото), а если он неизвестен — сам file_id.
+    """
+    unique_ids = list(file_unique_ids or [])
+    result = []
+    for i, file_id in enumerate(file_ids):
+        unique_id = unique_ids[i] if i < len(unique_ids) else None
+        result.append(unique_id or input_photo_cache.unique_id_for(file_id) or file_id)
+    return result
+
+
+def photoshoot_cache_key(
+    style_title: str,
+    style_prompt: Optional[str] = None,
+    user_photo_file_id: Optional[str] = None,
+    user_photo_file_ids: Optional[Union[Sequence[str], str]] = None,
+    user_photo_file_unique_ids: Optional[Sequence[str]] = None,
+    provider: Optional[str] = None,
+    image_size: str = IMAGE_SIZE_DEFAULT,
+) -> Optional[str]:
+    """
+    Ключ кеша результатов для генерации с такими параметрами (None — если нет входных фото).
+    """
+    file_ids = _normalize_input_file_ids(user_photo_file_id=user_photo_file_id, user_photo_file_ids=user_photo_file_ids)
+    if not file_ids:
+        return None
+    file_ids = file_ids[:MAX_INPUT_PHOTOS]
+
+    return result_cache_key(
+        prompt_text=_build_prompt(style_title=style_title, style_prompt=style_prompt),
+        model_name=get_provider(provider).label,
+        image_size=image_size,
+        aspect_ratio=ASPECT_RATIO_DEFAULT,
+        input_ids=_input_cache_ids(file_ids, user_photo_file_unique_ids),
+    )
+
+
+def find_cached_photoshoot(
+    style_title: str,
+    style_prompt: Optional[str] = None,
+    user_photo_file_id: Optional[str] = None,
+    user_photo_file_ids: Optional[Union[Sequence[str], str]] = None,
+    user_photo_file_unique_ids: Optional[Sequence[str]] = None,
+    provider: Optional[str] = None,
+) -> Optional[Tuple[StoredOutput, str]]:
+    """
+    Готовый результат из кеша (без запроса к провайдеру) и его размер — или None.
+    Хендлеры проверяют его до списания: повтор того же запроса не оплачивается второй раз.
+    Под нагрузкой результат мог быть сделан в 2K/1K — смотрим все размеры, от лучшего.
+    """
+    for image_size in IMAGE_SIZES:
+        key = photoshoot_cache_key(
+            style_title=style_title,
+            style_prompt=style_prompt,
+            user_photo_file_id=user_photo_file_id,
+            user_photo_file_ids=user_photo_file_ids,
+            user_photo_file_unique_ids=user_photo_file_unique_ids,
+            provider=provider,
+            image_size=image_size,
+        )
+        if key is None:
+            return None
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached, image_size
+    return None
+
+
 async def generate_photoshoot_image(
     style_title: str,
     style_prompt: Optional[str] = None,
     user_photo_file_id: Optional[str] = None,
     bot: Optional[Bot] = None,
     user_photo_file_ids: Optional[Union[Sequence[str], str]] = None,
-) -> FSInputFile:
+    input_photos: Optional[Sequence[bytes]] = None,
+    user_photo_file_unique_ids: Optional[Sequence[str]] = None,
+    force_regenerate: bool = False,
+    provider: Optional[str] = None,
+    image_size: str = IMAGE_SIZE_DEFAULT,
+    on_preview: Optional[Callable[[StoredOutput], Awaitable[None]]] = None,
+    prepared_photos: Optional[PreparedPhotos] = None,
+) -> StoredOutput:
     """
-    Генерация фотосессии через APIYI (Google-формат generateContent).
+    Генерация фотосессии (Google-формат generateContent) через провайдера provider
+    (по умолчанию — settings.GENERATION_PROVIDER, см. providers.py).
 
     Совместимость по входу:
     - Можно передавать ОДНО фото через user_photo_file_id="id"
@@ -155,22 +368,95 @@ async def generate_photoshoot_image(
     - Можно передавать список 1..3 фото через user_photo_file_ids=[id1, id2, id3]
     - Можно передавать строку через user_photo_file_ids="id1,id2"
 
-    Запрашиваем 4K в ответ (если модель/тариф поддерживают).
+    Если фото уже скачаны заранее (download_input_photos параллельно со списанием и т.п.) —
+    передай их в input_photos в том же порядке, что и file_id; повторно качать не будем.
+    prepared_photos (prepare_input_photos) — фото уже обработаны и закодированы: так несколько
+    генераций по одному селфи (подборка стилей) не делают эту работу каждая заново.
+
+    Запрашиваем 4K в ответ (если модель/тариф поддерживают); под нагрузкой вызывающий
+    может попросить меньше — image_size="2K"/"1K" (см. quality.py).
+
+    on_preview — двухфазный режим: параллельно с основным уходит дешёвый запрос в PREVIEW_IMAGE_SIZE,
+    и если он готов раньше — вызывается on_preview(превью). Фото качаются, обрабатываются
+    и кодируются в base64 один раз на оба запроса.
+    Результат кладётся в хранилище (output_store) и возвращается ссылка на него:
+    для отправки в Telegram — result.as_input_file().
+
+    Повтор того же запроса (промпт, модель, размер, те же фото по file_unique_id)
+    отдаётся из кеша результатов без обращения к провайдеру; force_regenerate=True —
+    сгенерировать заново (новый вариант), результат заменит запись в кеше.
+    Если такой же запрос уже выполняется, вызов дожидается его результата (generation_flights).
     """
+    outputs = await _generate_outputs(
+        style_title=style_title,
+        style_prompt=style_prompt,
+        user_photo_file_id=user_photo_file_id,
+        bot=bot,
+        user_photo_file_ids=user_photo_file_ids,
+        input_photos=input_photos,
+        user_photo_file_unique_ids=user_photo_file_unique_ids,
+        force_regenerate=force_regenerate,
+        provider=provider,
+        image_size=image_size,
+        on_preview=on_preview,
+        prepared_photos=prepared_photos,
+    )
+    return outputs[0]
 
-    if bot is None:
-        raise RuntimeError("Параметр bot не передан в generate_photoshoot_image().")
 
-    # Совместимость: ключ можно хранить в COMET_API_KEY (как раньше),
-    # либо завести отдельный APIYI_API_KEY.
-    api_key = getattr(settings, "APIYI_API_KEY", None) or getattr(settings, "COMET_API_KEY", None)
-    if not api_key:
-        raise RuntimeError("API ключ не задан. Укажи settings.APIYI_API_KEY или settings.COMET_API_KEY.")
+async def generate_photoshoot_variants(
+    style_title: str,
+    style_prompt: Optional[str] = None,
+    bot: Optional[Bot] = None,
+    user_photo_file_ids: Optional[Union[Sequence[str], str]] = None,
+    input_photos: Optional[Sequence[bytes]] = None,
+    user_photo_file_unique_ids: Optional[Sequence[str]] = None,
+    force_regenerate: bool = False,
+    provider: Optional[str] = None,
+    image_size: str = IMAGE_SIZE_DEFAULT,
+    count: int = 1,
+) -> List[StoredOutput]:
+    """
+    Несколько вариантов одним запросом (generationConfig.candidateCount): загрузка фото
+    и промпт оплачиваются один раз на все варианты. Вариантов не больше, чем провайдер
+    отдаёт за запрос (GenerationProvider.max_candidates), — иначе просто один.
+    Параметры — как у generate_photoshoot_image; в кеш результатов попадает первый вариант.
+    """
+    return await _generate_outputs(
+        style_title=style_title,
+        style_prompt=style_prompt,
+        bot=bot,
+        user_photo_file_ids=user_photo_file_ids,
+        input_photos=input_photos,
+        user_photo_file_unique_ids=user_photo_file_unique_ids,
+        force_regenerate=force_regenerate,
+        provider=provider,
+        image_size=image_size,
+        candidate_count=count,
+    )
 
-    model_name = getattr(settings, "APIYI_MODEL_NAME", None) or APIYI_MODEL_NAME_DEFAULT
-    endpoint = f"{APIYI_BASE_URL}/v1beta/models/{model_name}:generateContent"
 
-    timeout_seconds = int(getattr(settings, "APIYI_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS))
+async def _generate_outputs(
+    style_title: str,
+    style_prompt: Optional[str] = None,
+    user_photo_file_id: Optional[str] = None,
+    bot: Optional[Bot] = None,
+    user_photo_file_ids: Optional[Union[Sequence[str], str]] = None,
+    input_photos: Optional[Sequence[bytes]] = None,
+    user_photo_file_unique_ids: Optional[Sequence[str]] = None,
+    force_regenerate: bool = False,
+    provider: Optional[str] = None,
+    image_size: str = IMAGE_SIZE_DEFAULT,
+    on_preview: Optional[Callable[[StoredOutput], Awaitable[None]]] = None,
+    prepared_photos: Optional[PreparedPhotos] = None,
+    candidate_count: int = 1,
+) -> List[StoredOutput]:
+    if bot is None and input_photos is None and prepared_photos is None:
+        raise RuntimeError("Параметр bot не передан в generate_photoshoot_image().")
+
+    adapter = get_provider(provider)
+    if not get_key_pool(adapter.name).has_keys():
+        raise RuntimeError(f"API ключ для провайдера {adapter.name} не задан в настройках.")
 
     # 0) Разбираем вход: 1..3 file_id
     file_ids = _normalize_input_file_ids(user_photo_file_id=user_photo_file_id, user_photo_file_ids=user_photo_file_ids)
@@ -179,166 +465,438 @@ async def generate_photoshoot_image(
     if len(file_ids) > MAX_INPUT_PHOTOS:
         file_ids = file_ids[:MAX_INPUT_PHOTOS]
 
-    # 1) Скачиваем 1..3 фото из Telegram
-    photos_bytes: List[bytes] = []
+    prompt_text = _build_prompt(style_title=style_title, style_prompt=style_prompt)
+
+    cache_key = result_cache_key(
+        prompt_text=prompt_text,
+        model_name=adapter.label,
+        image_size=image_size,
+        aspect_ratio=ASPECT_RATIO_DEFAULT,
+        input_ids=_input_cache_ids(file_ids, user_photo_file_unique_ids),
+    )
+    if not force_regenerate:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Результат генерации взят из кеша: %s", cached.digest)
+            return [cached]
+
+    candidate_count = max(1, min(candidate_count, adapter.max_candidates))
+
+    async def _generate() -> List[StoredOutput]:
+        outputs = await _request_generation(
+            adapter=adapter,
+            bot=bot,
+            file_ids=file_ids,
+            file_unique_ids=user_photo_file_unique_ids,
+            input_photos=input_photos,
+            prompt_text=prompt_text,
+            image_size=image_size,
+            on_preview=on_preview,
+            prepared_photos=prepared_photos,
+            candidate_count=candidate_count,
+        )
+        result_cache.put(cache_key, outputs[0])
+        return outputs
+
+    if force_regenerate:
+        # «другой вариант» не должен получить тот же результат от уже идущего запроса;
+        # кеш своим результатом он всё равно обновит
+        return await _generate()
+
+    # если такой же запрос уже выполняется — ждём его результат, а не платим второй раз
+    flight_key = cache_key if candidate_count == 1 else f"{cache_key}:x{candidate_count}"
+    return await generation_flights.run(flight_key, _generate)
+
+
+async def _request_generation(
+    adapter: GenerationProvider,
+    bot: Optional[Bot],
+    file_ids: List[str],
+    file_unique_ids: Optional[Sequence[str]],
+    input_photos: Optional[Sequence[bytes]],
+    prompt_text: str,
+    image_size: str,
+    on_preview: Optional[Callable[[StoredOutput], Awaitable[None]]] = None,
+    prepared_photos: Optional[PreparedPhotos] = None,
+    candidate_count: int = 1,
+) -> List[StoredOutput]:
+    """
+    Общий для всех провайдеров конвейер: скачивание/предобработка фото, затем запрос
+    (с хеджированием, если настроен запасной провайдер, см. hedging.py).
+    Временные ошибки провайдера повторяются в пределах дедлайна задачи (см. retry.py).
+    С on_preview параллельно идёт запрос превью (см. generate_photoshoot_image).
+    Результат — все картинки ответа (одна или до candidate_count).
+    """
+
+    # Превью уходит туда же, куда основной запрос. Без imageConfig (comet) это тот же
+    # полноценный запрос — не быстрее и по полной цене, поэтому превью нет
+    preview_adapter = _route(adapter) if on_preview is not None else None
+    progressive = (
+        preview_adapter is not None
+        and image_size != PREVIEW_IMAGE_SIZE
+        and adapter.supports_image_config
+        and preview_adapter.supports_image_config
+    )
+
+    if prepared_photos is not None:
+        photos_bytes = prepared_photos.photos_bytes
+        encoded_blobs = prepared_photos.encoded_blobs
+    else:
+        # 1) Скачиваем 1..3 фото из Telegram (параллельно), если их не скачали заранее
+        if input_photos is not None:
+            photos_bytes = list(input_photos)[:len(file_ids)]
+        else:
+            photos_bytes = await download_input_photos(bot, file_ids, file_unique_ids)
+
+        # EXIF-поворот, уменьшение до PREPROCESS_MAX_EDGE и пережатие (в пуле процессов)
+        photos_bytes = await preprocess_photos(photos_bytes)
+        encoded_blobs = None
+
+    if progressive and encoded_blobs is None:
+        # два запроса с одними фото — base64 считаем один раз (иначе — потоково при отправке)
+        encoded_blobs = await encode_blobs(photos_bytes, run_codec=run_codec)
+
+    async def _attempt() -> List[StoredOutput]:
+        # автомат провайдера разомкнут — сразу на запасной (если есть), а не ждать таймаут
+        routed = _route(adapter)
+
+        async def _primary() -> List[StoredOutput]:
+            return await _send_generation(
+                routed,
+                photos_bytes,
+                prompt_text,
+                image_size,
+                encoded_blobs=encoded_blobs,
+                candidate_count=candidate_count,
+            )
+
+        hedge = _hedge_target(routed)
+        if hedge is None:
+            return await _primary()
+
+        hedge_adapter, hedge_key = hedge
+
+        async def _backup() -> List[StoredOutput]:
+            return await _send_generation(
+                hedge_adapter,
+                photos_bytes,
+                prompt_text,
+                image_size,
+                api_key=hedge_key,
+                encoded_blobs=encoded_blobs,
+                candidate_count=candidate_count,
+            )
+
+        # результат кладётся в кеш под ключом основного провайдера: запрос тот же
+        return await generation_hedger.run(_primary, _backup, delay=generation_hedger.delay_for(routed.stats))
+
+    if not progressive:
+        return await generation_retry.run(_attempt)
+
+    final_task = asyncio.ensure_future(generation_retry.run(_attempt))
+    # превью — без повторов и хеджирования: не успело или упало — просто ждём основной результат
+    preview_task = asyncio.ensure_future(
+        _send_generation(preview_adapter, photos_bytes, prompt_text, PREVIEW_IMAGE_SIZE, encoded_blobs=encoded_blobs)
+    )
     try:
-        for fid in file_ids:
-            b = await _download_telegram_photo(bot, fid)
-            photos_bytes.append(b)
-    except Exception as e:
-        logger.exception("Ошибка при скачивании фото из Telegram: %s", e)
-        raise RuntimeError("Не удалось скачать фото из Telegram") from e
+        done, _ = await asyncio.wait({final_task, preview_task}, return_when=asyncio.FIRST_COMPLETED)
+        if final_task not in done and preview_task.exception() is None:
+            try:
+                await on_preview(preview_task.result()[0])
+            except Exception as e:
+                logger.warning("Не удалось показать превью: %s", e)
+        return await final_task
+    finally:
+        for task in (preview_task, final_task):
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+
+def _route(adapter: GenerationProvider) -> GenerationProvider:
+    """
+    Провайдер для запроса: основной, если его автомат пропускает запросы,
+    иначе запасной (settings.GENERATION_FALLBACK_PROVIDER). Если и его нет —
+    основной: его автомат сам откажет без запроса (см. circuit_breaker.py).
+    """
+    if get_breaker(adapter.name).allows_request():
+        return adapter
+    name = settings.GENERATION_FALLBACK_PROVIDER
+    if not name or name == adapter.name:
+        return adapter
+    fallback = get_provider(name)
+    if not get_key_pool(fallback.name).has_keys() or not get_breaker(fallback.name).allows_request():
+        return adapter
+    logger.warning("Провайдер %s недоступен — запрос уходит на %s", adapter.name, fallback.name)
+    return fallback
+
+
+def _hedge_target(adapter: GenerationProvider) -> Optional[Tuple[GenerationProvider, Optional[str]]]:
+    """
+    Запасной провайдер и ключ для хеджирования (None — хеджирование выключено или некуда).
+    Ключ None — взять из пула ключей провайдера.
+    """
+    name = settings.GENERATION_HEDGE_PROVIDER
+    if not name:
+        return None
+    hedge_adapter = get_provider(name)
+    if not get_breaker(hedge_adapter.name).allows_request():
+        return None
+    hedge_key = settings.GENERATION_HEDGE_API_KEY or None
+    pool_size = len(get_key_pool(hedge_adapter.name).keys)
+    if hedge_key is None and not pool_size:
+        return None
+    if hedge_adapter.name == adapter.name and hedge_key is None and pool_size < 2:
+        # тот же провайдер с тем же ключом — это не запасной путь, а просто дубль
+        return None
+    return hedge_adapter, hedge_key
+
+
+async def _send_generation(
+    adapter: GenerationProvider,
+    photos_bytes: Sequence[bytes],
+    prompt_text: str,
+    image_size: str,
+    api_key: Optional[str] = None,
+    encoded_blobs: Optional[Sequence[bytes]] = None,
+    candidate_count: int = 1,
+) -> List[StoredOutput]:
+    """
+    Один запрос к провайдеру: ключ из пула (api_key — явный ключ в обход пула),
+    затем автомат провайдера и AIMD-лимит параллельности.
 
-    prompt_text = _build_prompt(style_title=style_title, style_prompt=style_prompt)
+    Ключ берём до автомата: «все ключи отдыхают» — наше локальное состояние,
+    а не сбой провайдера, и автомат размыкать не должно.
+    """
 
-    # 2) Собираем parts: сначала текст, затем 1..3 inline_data
+    async def _guarded(key: str) -> List[StoredOutput]:
+        async with get_breaker(adapter.name).guard():
+            async with get_limit(adapter.name).slot():
+                return await _post_generation(
+                    adapter, key, photos_bytes, prompt_text, image_size, encoded_blobs, candidate_count
+                )
+
+    if api_key is not None:
+        return await _guarded(api_key)
+    # наименее загруженный ключ; после 401/403/429 ключ отдыхает, см. key_pool.py
+    async with get_key_pool(adapter.name).lease() as pooled_key:
+        return await _guarded(pooled_key)
+
+
+async def _post_generation(
+    adapter: GenerationProvider,
+    api_key: str,
+    photos_bytes: Sequence[bytes],
+    prompt_text: str,
+    image_size: str,
+    encoded_blobs: Optional[Sequence[bytes]] = None,
+    candidate_count: int = 1,
+) -> List[StoredOutput]:
+    """
+    Сам запрос: потоковая отправка, потоковый разбор ответа, запись в хранилище.
+    Отличия провайдеров — в адаптере. Задержка и класс ошибки пишутся в adapter.stats.
+    candidate_count > 1 — несколько кандидатов в одном ответе (если адаптер их отдаёт).
+    """
+    # запрос мог уйти на запасной провайдер — у него может быть свой предел
+    candidate_count = max(1, min(candidate_count, adapter.max_candidates))
+
+    # 2) Собираем parts: сначала текст, затем 1..3 inline_data.
+    # Вместо base64-строк — заглушки: base64 генерируется на лету при отправке (StreamingJsonBody)
     parts = [{"text": prompt_text}]
-    for b in photos_bytes:
+    for i, b in enumerate(photos_bytes):
         mime_type_in = _detect_mime_type(b)
-        image_b64 = base64.b64encode(b).decode("utf-8")
         parts.append(
             {
                 "inline_data": {
                     "mime_type": mime_type_in,
-                    "data": image_b64,
+                    "data": blob_placeholder(i),
                 }
             }
         )
 
-    # 3) Просим 4K (важно: модель должна поддерживать 4K)
-    payload = {
-        "contents": [{"parts": parts}],
-        "generationConfig": {
-            "responseModalities": ["IMAGE"],
-            "imageConfig": {
-                "aspectRatio": "3:4",
-                "imageSize": "4K",
-            },
-        },
-    }
-
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "Accept": "*/*",
-    }
-
-    # SSL
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    connector = aiohttp.TCPConnector(ssl=ssl_context)
-
-    data = None
-    resp_text = ""
-
-    # 4) Запрос
-    try:
-        async with aiohttp.ClientSession(connector=connector) as session:
-            async with session.post(
-                endpoint,
-                json=payload,
-                headers=headers,
-                timeout=timeout_seconds,
-            ) as resp:
-                resp_text = await resp.text()
-                try:
-                    data = await resp.json()
-                except Exception:
-                    data = None
-
-                if resp.status != 200:
-                    error_code = None
-                    error_message = None
-                    if isinstance(data, dict):
-                        err = data.get("error") or {}
-                        error_code = err.get("code")
-                        error_message = err.get("message")
-
-                    logger.error(
-                        "APIYI ошибка: status=%s, code=%s, message=%s, body=%s",
-                        resp.status,
-                        error_code,
-                        error_message,
-                        resp_text,
-                    )
-
-                    if error_message and ("imageSize" in error_message or "4K" in error_message):
-                        raise RuntimeError(
-                            "Сервис отклонил запрос 4K (imageSize=4K). "
-                            "Проверь модель/тариф или попробуй модель, которая поддерживает 4K."
-                        )
-
-                    if resp.status in (401, 403):
-                        raise RuntimeError(
-                            "Сервис генерации отклонил запрос (ключ/квота/доступ). "
-                            "Проверь API ключ и лимиты."
-                        )
-
-                    raise RuntimeError("Сервис генерации фото сейчас недоступен. Попробуй позже.")
-
-    except Exception as e:
-        logger.exception("Ошибка при запросе к APIYI: %s", e)
-        raise RuntimeError(str(e)) from e
-
-    # 5) Достаём картинку
-    image_bytes: Optional[bytes] = None
-    mime_type_out: str = "image/jpeg"
-
-    try:
-        if not isinstance(data, dict):
-            logger.error("Некорректный ответ (не JSON). body=%s", resp_text)
-            raise RuntimeError("Сервис вернул некорректный ответ")
-
-        candidates = data.get("candidates") or []
-        if not candidates:
-            raise RuntimeError("Сервис не вернул кандидатов изображения")
+    # 3) Просим 4K или меньше под нагрузкой (модель должна поддерживать размер; адаптер решает, передавать ли imageConfig)
+    payload = adapter.build_payload(
+        parts,
+        image_size=image_size,
+        aspect_ratio=ASPECT_RATIO_DEFAULT,
+        candidate_count=candidate_count,
+    )
+    body = StreamingJsonBody(
+        payload,
+        photos_bytes,
+        chunk_raw_bytes=REQUEST_OFFLOAD_CHUNK_BYTES,
+        run_codec=run_codec,
+        encoded_blobs=encoded_blobs,
+    )
 
-        parts_out = candidates[0].get("content", {}).get("parts", [])
-        if not isinstance(parts_out, list):
-            parts_out = []
+    headers = adapter.headers(api_key)
+    headers["Content-Length"] = str(body.size)
 
-        for part in parts_out:
-            if not isinstance(part, dict):
-                continue
+    store = get_output_store()
+    sinks: List[PendingOutput] = []
 
-            inline_data = part.get("inlineData") or part.get("inline_data")
-            if not inline_data or not isinstance(inline_data, dict):
-                continue
+    def _open_sink() -> PendingOutput:
+        # картинка декодируется сразу во временный файл хранилища (sha256 считается на лету)
+        pending = store.open_pending()
+        sinks.append(pending)
+        return pending
 
-            mime = inline_data.get("mimeType") or inline_data.get("mime_type")
-            b64_data = inline_data.get("data")
-            if not b64_data:
-                continue
+    def _discard_sinks() -> None:
+        for pending in sinks:
+            store.discard(pending)
 
-            mime_type_out = mime or mime_type_out
-            image_bytes = base64.b64decode(b64_data)
-            break
+    decoder = InlineImageStreamDecoder(
+        open_sink=_open_sink,
+        max_images=candidate_count,
+        max_bytes=settings.PROVIDER_MAX_RESPONSE_BYTES,
+    )
+    decode_error: Optional[StreamDecodeError] = None
+
+    started_at = time.monotonic()
+
+    def _fail(
+        message: str,
+        error_class: str,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ) -> ProviderError:
+        _discard_sinks()
+        adapter.stats.record(time.monotonic() - started_at, error_class)
+        return provider_error(message, error_class, provider=adapter.name, status=status, retry_after=retry_after)
+
+    # не ждём ответа дольше, чем осталось до дедлайна задачи
+    timeout_seconds = adapter.timeout_seconds
+    remaining = deadline_remaining()
+    if remaining is not None:
+        timeout_seconds = max(1.0, min(timeout_seconds, remaining))
+
+    # 4) Запрос (через общий пул соединений, см. provider_client)
+    try:
+        session = await get_provider_client().get_session()
+        async with session.post(
+            adapter.endpoint(),
+            data=body.iter_chunks(),
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=timeout_seconds),
+        ) as resp:
+            if resp.status != 200:
+                resp_text = await _read_error_body(resp)
+                try:
+                    data = json.loads(resp_text)
+                except ValueError:
+                    data = None
 
-        if not image_bytes:
-            raise RuntimeError("Не удалось получить изображение из ответа сервиса")
+                error_code = None
+                error_message = None
+                if isinstance(data, dict):
+                    err = data.get("error") or {}
+                    error_code = err.get("code")
+                    error_message = err.get("message")
+
+                logger.error(
+                    "%s ошибка: status=%s, code=%s, message=%s, body=%s",
+                    adapter.label,
+                    resp.status,
+                    error_code,
+                    error_message,
+                    resp_text,
+                )
+
+                error_class = adapter.classify_error(resp.status, error_code, error_message)
+                raise _fail(
+                    adapter.error_text(error_class, error_message),
+                    error_class,
+                    status=resp.status,
+                    retry_after=parse_retry_after(resp.headers.get("Retry-After")),
+                )
+
+            # 200: разбираем JSON потоково, base64 картинки декодируется кусками в файл.
+            # Куски копим в пачку и отдаём декодеру в пул потоков (base64 + запись на диск)
+            try:
+                if resp.content_length and resp.content_length > settings.PROVIDER_MAX_RESPONSE_BYTES:
+                    raise ResponseTooLargeError(f"Content-Length={resp.content_length}")
+
+                batch: List[bytes] = []
+                batch_size = 0
+                async for chunk in resp.content.iter_chunked(RESPONSE_CHUNK_SIZE):
+                    batch.append(chunk)
+                    batch_size += len(chunk)
+                    if batch_size >= settings.CODEC_OFFLOAD_THRESHOLD_BYTES:
+                        await run_codec(decoder.feed_many, batch, size=batch_size)
+                        batch = []
+                        batch_size = 0
+                await run_codec(decoder.feed_many, batch, size=batch_size)
+                decoder.close()
+            except StreamDecodeError as e:
+                decode_error = e
+
+    except asyncio.CancelledError:
+        _discard_sinks()
+        raise
+    except ProviderError:
+        raise
+    except asyncio.TimeoutError as e:
+        logger.error("%s: нет ответа за %.0f с", adapter.label, timeout_seconds)
+        raise _fail("Сервис генерации не ответил вовремя. Попробуй позже.", ERROR_TIMEOUT) from e
+    except (aiohttp.ClientError, OSError) as e:
+        logger.error("%s: ошибка соединения: %r", adapter.label, e)
+        raise _fail("Сервис генерации фото сейчас недоступен. Попробуй позже.", ERROR_NETWORK) from e
     except Exception as e:
-        logger.exception("Ошибка при разборе ответа APIYI: %s", e)
-        raise RuntimeError("Ошибка при обработке ответа сервиса генерации") from e
+        _discard_sinks()
+        logger.exception("Ошибка при запросе к %s: %s", adapter.label, e)
+        raise RuntimeError("Ошибка при обращении к сервису генерации") from e
 
-    # 6) Сохраняем во временный файл
+    # 5) Достаём картинку.
+    # Оборванный/битый ответ — ERROR_BAD_RESPONSE (повторяем); картинки нет или ответ больше
+    # лимита — ERROR_NO_IMAGE: тот же запрос даст то же самое, повтор не делаем
     try:
-        tmp_dir = tempfile.gettempdir()
-        ext = ".jpg"
-        if "png" in mime_type_out:
-            ext = ".png"
-        elif "webp" in mime_type_out:
-            ext = ".webp"
-
-        # безопасное имя
-        joined_ids = "_".join(file_ids)
-        slug = _safe_slug(joined_ids)
+        if decode_error is not None:
+            logger.error(
+                "Некорректный ответ (%s). received=%s, head=%r",
+                decode_error,
+                decoder.received,
+                decoder.head,
+            )
+            if isinstance(decode_error, ResponseTooLargeError):
+                raise _fail("Сервис вернул слишком большой ответ", ERROR_NO_IMAGE) from decode_error
+            raise RuntimeError("Сервис вернул некорректный ответ")
 
-        suffix = f"{len(file_ids)}p"
-        file_path = os.path.join(tmp_dir, f"photoshoot_{slug}_{suffix}{ext}")
+        if not decoder.candidates_count:
+            logger.error("%s: ответ без кандидатов изображения, head=%r", adapter.label, decoder.head)
+            raise _fail(
+                "Сервис не смог сгенерировать фото по этому запросу. Попробуй другое фото или стиль 🙏",
+                ERROR_NO_IMAGE,
+            )
+
+        # пустые кандидаты (например, отфильтрованные провайдером) пропускаем
+        images = [image for image in decoder.images if image.size]
+        if not images:
+            logger.error("%s: в ответе нет изображения, head=%r", adapter.label, decoder.head)
+            raise _fail(
+                "Сервис не смог сгенерировать фото по этому запросу. Попробуй другое фото или стиль 🙏",
+                ERROR_NO_IMAGE,
+            )
+    except ProviderError:
+        raise
+    except Exception as e:
+        logger.exception("Ошибка при разборе ответа %s: %s", adapter.label, e)
+        raise _fail("Ошибка при обработке ответа сервиса генерации", ERROR_BAD_RESPONSE) from e
 
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
+    adapter.stats.record(time.monotonic() - started_at)
 
-        return FSInputFile(file_path)
+    # 6) Кладём результат в хранилище: атомарное переименование в <sha256><ext>
+    try:
+        outputs: List[StoredOutput] = []
+        for image in images:
+            mime_type_out: str = image.mime_type or "image/jpeg"
+            output = await store.commit(image.sink, mime_type_out)
+            # одинаковые кандидаты хранятся одним файлом — и показывать их дважды незачем
+            if all(output.digest != other.digest for other in outputs):
+                outputs.append(output)
+        _discard_sinks()
+        return outputs
     except Exception as e:
+        _discard_sinks()
         logger.exception("Ошибка при сохранении сгенерированного фото: %s", e)
-        raise RuntimeError("Не удалось сохранить сгенерированное фото") from e
\ No newline at end of file
+        raise RuntimeError("Не удалось сохранить сгенерированное фото") from e
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence
+
+from PIL import Image, ImageOps
+
+from src.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+# Накопительная статистика (для логов/админки)
+preprocess_stats = {
+    "photos": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "failed": 0,
+}
+
+
+def _prepare_photo_sync(data: bytes, max_edge: int, quality: int) -> bytes:
+    """
+    Выполняется в отдельном процессе:
+    - применяем поворот из EXIF,
+    - уменьшаем до max_edge по длинной стороне (не увеличиваем),
+    - пережимаем в JPEG с нужным качеством.
+    Если результат не меньше исходника и менять ничего не нужно — отдаём исходник.
+    """
+    with Image.open(io.BytesIO(data)) as src:
+        orientation = src.getexif().get(0x0112, 1)
+        img = ImageOps.exif_transpose(src)
+
+        resized = max(img.size) > max_edge
+        if resized:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+
+    result = out.getvalue()
+    if not resized and orientation == 1 and len(result) >= len(data):
+        return data
+    return result
+
+
+def get_preprocess_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: воркеры не наследуют потоки и сокеты бота
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.PREPROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+async def _prepare_photo(data: bytes) -> bytes:
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            get_preprocess_executor(),
+            _prepare_photo_sync,
+            data,
+            settings.PREPROCESS_MAX_EDGE,
+            settings.PREPROCESS_JPEG_QUALITY,
+        )
+    except Exception as e:
+        # предобработка — оптимизация, без неё генерация всё равно возможна
+        preprocess_stats["failed"] += 1
+        logger.warning("Не удалось предобработать фото, отправляем как есть: %s", e)
+        return data
+
+
+async def preprocess_photos(photos: Sequence[bytes]) -> List[bytes]:
+    """
+    Готовит входные фото к отправке провайдеру (параллельно, в пуле процессов).
+    Возвращает фото в том же порядке; сэкономленные байты пишем в лог и в preprocess_stats.
+    """
+    if not settings.PREPROCESS_ENABLED or not photos:
+        return list(photos)
+
+    prepared = list(await asyncio.gather(*(_prepare_photo(p) for p in photos)))
+
+    bytes_in = sum(len(p) for p in photos)
+    bytes_out = sum(len(p) for p in prepared)
+    preprocess_stats["photos"] += len(photos)
+    preprocess_stats["bytes_in"] += bytes_in
+    preprocess_stats["bytes_out"] += bytes_out
+
+    logger.info(
+        "Предобработка фото: %s шт., %s → %s байт (сэкономлено %s)",
+        len(photos),
+        bytes_in,
+        bytes_out,
+        bytes_in - bytes_out,
+    )
+    return prepared
+
+
+def shutdown_preprocess_executor() -> None:
+    global _executor
+    if _executor is None:
+        return
+    executor, _executor = _executor, None
+    executor.shutdown(wait=True, cancel_futures=True)
+    logger.info("Пул процессов предобработки остановлен")
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import ssl
+from typing import Optional, Sequence
+
+import aiohttp
+import certifi
+
+from src.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Прогрев: сколько секунд ждём ответа на HEAD-запрос
+WARMUP_TIMEOUT_SECONDS = 10
+
+
+class ProviderHttpClient:
+    """
+    Долгоживущий HTTP-клиент для провайдеров генерации.
+
+    Один ClientSession + TCPConnector на весь процесс:
+    - keep-alive соединений (TLS-рукопожатие не повторяется на каждый запрос),
+    - кеш DNS,
+    - общий лимит соединений и лимит на один хост.
+
+    Жизненным циклом управляет бот: start() на старте, close() на остановке.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 16,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 60.0,
+    ) -> None:
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._dns_cache_ttl = dns_cache_ttl
+        self._keepalive_timeout = keepalive_timeout
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_started(self) -> bool:
+        return self._session is not None and not self._session.closed
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        # certifi парсим один раз на весь процесс
+        ssl_context = ssl.create_default_context(cafile=certifi.where())
+        connector = aiohttp.TCPConnector(
+            ssl=ssl_context,
+            limit=self._limit,
+            limit_per_host=self._limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self._dns_cache_ttl,
+            keepalive_timeout=self._keepalive_timeout,
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    async def start(self) -> aiohttp.ClientSession:
+        """
+        Создаёт сессию (если ещё не создана) и возвращает её.
+        """
+        async with self._lock:
+            if not self.is_started:
+                self._session = self._create_session()
+                logger.info(
+                    "HTTP-клиент провайдера запущен: limit=%s, limit_per_host=%s, dns_ttl=%s, keepalive=%s",
+                    self._limit,
+                    self._limit_per_host,
+                    self._dns_cache_ttl,
+                    self._keepalive_timeout,
+                )
+            return self._session
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """
+        Сессия для запроса к провайдеру.
+        Если бот не вызвал start() (например, функцию дёрнули из скрипта) — стартуем лениво.
+        """
+        if self.is_started:
+            return self._session
+        return await self.start()
+
+    async def warmup(self, base_urls: Sequence[str], connections: int = 1) -> None:
+        """
+        Заранее открывает соединения к провайдерам (DNS + TCP + TLS),
+        чтобы первый пользователь не платил за рукопожатие.
+        Ошибки прогрева не критичны — только логируем.
+        """
+        session = await self.get_session()
+        timeout = aiohttp.ClientTimeout(total=WARMUP_TIMEOUT_SECONDS)
+
+        async def _ping(url: str) -> None:
+            try:
+                async with session.head(url, timeout=timeout) as resp:
+                    await resp.release()
+            except Exception as e:
+                logger.warning("Прогрев соединения с %s не удался: %s", url, e)
+
+        tasks = [_ping(url) for url in base_urls for _ in range(max(1, connections))]
+        await asyncio.gather(*tasks)
+        logger.info("Прогрев соединений завершён: %s", ", ".join(base_urls))
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._session is None:
+                return
+            session, self._session = self._session, None
+            if not session.closed:
+                await session.close()
+            logger.info("HTTP-клиент провайдера закрыт")
+
+
+_client: Optional[ProviderHttpClient] = None
+
+
+def get_provider_client() -> ProviderHttpClient:
+    """
+    Общий на процесс клиент провайдеров (создаётся по настройкам при первом обращении).
+    """
+    global _client
+    if _client is None:
+        _client = ProviderHttpClient(
+            limit=settings.PROVIDER_HTTP_LIMIT,
+            limit_per_host=settings.PROVIDER_HTTP_LIMIT_PER_HOST,
+            dns_cache_ttl=settings.PROVIDER_DNS_CACHE_TTL,
+            keepalive_timeout=settings.PROVIDER_KEEPALIVE_TIMEOUT,
+        )
+    return _client
@@ -0,0 +1,368 @@
+from __future__ import annotations
+
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from src.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Классы ошибок провайдера (для статистики; одинаковые для всех адаптеров)
+ERROR_AUTH = "auth"  # 401/403: ключ, доступ
+ERROR_QUOTA = "quota"  # закончился оплаченный лимит
+ERROR_RATE_LIMIT = "rate_limit"  # 429
+ERROR_BAD_REQUEST = "bad_request"  # 4xx: параметры (например, imageSize)
+ERROR_SERVER = "server"  # 5xx
+ERROR_TIMEOUT = "timeout"
+ERROR_NETWORK = "network"  # соединение/DNS/обрыв
+ERROR_BAD_RESPONSE = "bad_response"  # 200, но ответ оборван / не разобрать
+ERROR_NO_IMAGE = "no_image"  # 200, но картинки нет (нет кандидатов, фильтр) или ответ больше лимита
+ERROR_CIRCUIT_OPEN = "circuit_open"  # запрос не отправляли: автомат провайдера разомкнут
+ERROR_NO_KEYS = "no_keys"  # запрос не отправляли: все ключи провайдера отдыхают после ошибок
+
+# Сколько последних задержек храним для перцентилей
+LATENCY_SAMPLES = 200
+
+
+class ProviderError(RuntimeError):
+    """
+    Ошибка запроса к провайдеру. Текст — для пользователя (как и раньше у RuntimeError),
+    error_class — для статистики и решений (повторить, переключиться на другой провайдер).
+    Конкретный тип — по классу ошибки, см. provider_error().
+    """
+
+    # имеет ли смысл повторить тот же запрос
+    retryable = False
+
+    def __init__(
+        self,
+        message: str,
+        error_class: str,
+        provider: str = "",
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ) -> None:
+        super().__init__(message)
+        self.error_class = error_class
+        self.provider = provider
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ProviderAuthError(ProviderError):
+    """
+    Ключ отклонён или закончилась квота: повтор не поможет.
+    """
+
+
+class ProviderBadRequest(ProviderError):
+    """
+    Провайдер отклонил параметры запроса (например, imageSize=4K): повтор не поможет.
+    """
+
+
+class ProviderRateLimited(ProviderError):
+    """
+    429: повторить можно, но не раньше Retry-After.
+    """
+
+    retryable = True
+
+
+class ProviderTransientError(ProviderError):
+    """
+    Обрыв соединения, таймаут, 5xx: обычно проходит при повторе.
+    """
+
+    retryable = True
+
+
+class ProviderBadResponse(ProviderError):
+    """
+    200, но ответ оборван или это не JSON: обычно сбой доставки, повтор может пройти.
+    """
+
+    retryable = True
+
+
+class ProviderNoImage(ProviderError):
+    """
+    200, но картинки нет (чаще всего — фильтр безопасности) или ответ больше лимита:
+    на тот же запрос ответ будет тем же, повтор — лишний платный вызов.
+    """
+
+
+class ProviderUnavailable(ProviderError):
+    """
+    Запрос не отправляли: автомат провайдера разомкнут.
+    """
+
+
+_ERROR_TYPES = {
+    ERROR_AUTH: ProviderAuthError,
+    ERROR_QUOTA: ProviderAuthError,
+    ERROR_BAD_REQUEST: ProviderBadRequest,
+    ERROR_RATE_LIMIT: ProviderRateLimited,
+    ERROR_SERVER: ProviderTransientError,
+    ERROR_TIMEOUT: ProviderTransientError,
+    ERROR_NETWORK: ProviderTransientError,
+    ERROR_BAD_RESPONSE: ProviderBadResponse,
+    ERROR_NO_IMAGE: ProviderNoImage,
+    ERROR_CIRCUIT_OPEN: ProviderUnavailable,
+    ERROR_NO_KEYS: ProviderRateLimited,
+}
+
+
+def provider_error(
+    message: str,
+    error_class: str,
+    provider: str = "",
+    status: Optional[int] = None,
+    retry_after: Optional[float] = None,
+) -> ProviderError:
+    """
+    Исключение нужного типа для класса ошибки.
+    """
+    error_type = _ERROR_TYPES.get(error_class, ProviderError)
+    return error_type(message, error_class, provider=provider, status=status, retry_after=retry_after)
+
+
+class ProviderStats:
+    """
+    Задержки и ошибки одного провайдера.
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.successes = 0
+        self.errors: Dict[str, int] = {}
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, latency: float, error_class: Optional[str] = None) -> None:
+        self.requests += 1
+        if error_class is None:
+            self.successes += 1
+            self._latencies.append(latency)
+        else:
+            self.errors[error_class] = self.errors.get(error_class, 0) + 1
+
+    @property
+    def latency_samples(self) -> int:
+        return len(self._latencies)
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        """
+        Перцентиль задержки успешных запросов (None — пока нет данных).
+        """
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def as_dict(self) -> Dict[str, object]:
+        p50 = self.latency_percentile(0.5)
+        p95 = self.latency_percentile(0.95)
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "errors": dict(self.errors),
+            "latency_p50_seconds": round(p50, 3) if p50 is not None else None,
+            "latency_p95_seconds": round(p95, 3) if p95 is not None else None,
+        }
+
+
+class GenerationProvider:
+    """
+    Адаптер провайдера генерации в Google-формате generateContent.
+
+    Общий конвейер (photoshoot._request_generation) собирает parts и стримит запрос/ответ;
+    адаптер отвечает только за то, чем провайдеры отличаются: адрес, авторизация,
+    таймаут, детали payload и тексты ошибок.
+    """
+
+    name = "base"
+    base_url = ""
+    default_model = ""
+    default_timeout_seconds = 360.0
+    # понимает ли провайдер generationConfig.imageConfig (aspectRatio/imageSize)
+    supports_image_config = True
+    # сколько кандидатов отдаёт за запрос, если не задано в settings.PROVIDER_MAX_CANDIDATES
+    default_max_candidates = 1
+
+    def __init__(self, name: Optional[str] = None) -> None:
+        if name:
+            self.name = name
+        self.stats = ProviderStats()
+
+    @property
+    def model_name(self) -> str:
+        return self.default_model
+
+    @property
+    def timeout_seconds(self) -> float:
+        return self.default_timeout_seconds
+
+    @property
+    def max_candidates(self) -> int:
+        return max(1, settings.PROVIDER_MAX_CANDIDATES.get(self.name, self.default_max_candidates))
+
+    @property
+    def label(self) -> str:
+        """
+        Подпись для логов/статистики/кеша: провайдер и модель.
+        """
+        return f"{self.name}:{self.model_name}"
+
+    def api_key(self) -> Optional[str]:
+        raise NotImplementedError
+
+    def endpoint(self) -> str:
+        return f"{self.base_url}/v1beta/models/{self.model_name}:generateContent"
+
+    def headers(self, api_key: str) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Accept": "*/*",
+        }
+
+    def build_payload(self, parts: List[dict], image_size: str, aspect_ratio: str, candidate_count: int = 1) -> dict:
+        generation_config: dict = {"responseModalities": ["IMAGE"]}
+        if self.supports_image_config:
+            generation_config["imageConfig"] = {
+                "aspectRatio": aspect_ratio,
+                "imageSize": image_size,
+            }
+        if candidate_count > 1:
+            generation_config["candidateCount"] = candidate_count
+        return {
+            "contents": [{"parts": parts}],
+            "generationConfig": generation_config,
+        }
+
+    def classify_error(self, status: int, error_code: Optional[str], error_message: Optional[str]) -> str:
+        if status in (401, 403):
+            if error_code == "insufficient_user_quota":
+                return ERROR_QUOTA
+            return ERROR_AUTH
+        if status == 429:
+            return ERROR_RATE_LIMIT
+        if status >= 500:
+            return ERROR_SERVER
+        return ERROR_BAD_REQUEST
+
+    def error_text(self, error_class: str, error_message: Optional[str]) -> str:
+        """
+        Сообщение для RuntimeError (его видит пользователь в простом режиме бота).
+        """
+        if error_class == ERROR_QUOTA:
+            return (
+                "На стороне сервиса генерации закончился оплаченный лимит. "
+                "Скоро всё починим — попробуй зайти позже 🙏"
+            )
+        if error_class == ERROR_AUTH:
+            return (
+                "Сервис генерации отклонил запрос (ключ/квота/доступ). "
+                "Проверь API ключ и лимиты."
+            )
+        return "Сервис генерации фото сейчас недоступен. Попробуй позже."
+
+
+class ApiyiProvider(GenerationProvider):
+    """
+    APIYI: Bearer-ключ, 4K через imageConfig, долгий таймаут.
+    """
+
+    name = "apiyi"
+    base_url = "https://api.apiyi.com"
+    # Модель по умолчанию: поддержка 1K/2K/4K (обычно)
+    default_model = "gemini-3-pro-image-preview"
+    # 4K может занимать дольше
+    default_timeout_seconds = 360.0
+
+    @property
+    def model_name(self) -> str:
+        return getattr(settings, "APIYI_MODEL_NAME", None) or self.default_model
+
+    @property
+    def timeout_seconds(self) -> float:
+        return float(getattr(settings, "APIYI_TIMEOUT_SECONDS", None) or self.default_timeout_seconds)
+
+    def api_key(self) -> Optional[str]:
+        # Совместимость: ключ можно хранить в COMET_API_KEY (как раньше),
+        # либо завести отдельный APIYI_API_KEY.
+        return getattr(settings, "APIYI_API_KEY", None) or getattr(settings, "COMET_API_KEY", None)
+
+    def error_text(self, error_class: str, error_message: Optional[str]) -> str:
+        # Частый кейс: размер (4K/2K) не поддержан моделью/планом или неверные параметры imageSize
+        if error_message and ("imageSize" in error_message or "4K" in error_message or "2K" in error_message):
+            return (
+                "Сервис отклонил запрошенный размер изображения (imageSize). "
+                "Проверь модель/тариф или попробуй модель, которая поддерживает 4K."
+            )
+        return super().error_text(error_class, error_message)
+
+
+class CometProvider(GenerationProvider):
+    """
+    CometAPI: ключ без «Bearer», role=user в contents, без imageConfig, таймаут 120 с.
+    """
+
+    name = "comet"
+    base_url = "https://api.cometapi.com"
+    default_model = "gemini-3-pro-image"
+    default_timeout_seconds = 120.0
+    supports_image_config = False
+
+    @property
+    def model_name(self) -> str:
+        return getattr(settings, "COMET_MODEL_NAME", None) or self.default_model
+
+    def api_key(self) -> Optional[str]:
+        return getattr(settings, "COMET_API_KEY", None)
+
+    def headers(self, api_key: str) -> Dict[str, str]:
+        headers = super().headers(api_key)
+        # В доке CometAI: Authorization: sk-xxxx
+        headers["Authorization"] = api_key
+        return headers
+
+    def build_payload(self, parts: List[dict], image_size: str, aspect_ratio: str, candidate_count: int = 1) -> dict:
+        payload = super().build_payload(parts, image_size, aspect_ratio, candidate_count)
+        payload["contents"][0]["role"] = "user"
+        return payload
+
+
+_providers: Dict[str, GenerationProvider] = {}
+
+
+def register_provider(provider: GenerationProvider) -> GenerationProvider:
+    _providers[provider.name] = provider
+    return provider
+
+
+def get_provider(name: Optional[str] = None) -> GenerationProvider:
+    """
+    Провайдер по имени; без имени — выбранный в settings.GENERATION_PROVIDER.
+    """
+    name = name or settings.GENERATION_PROVIDER
+    provider = _providers.get(name)
+    if provider is None:
+        raise RuntimeError(f"Неизвестный провайдер генерации: {name}")
+    return provider
+
+
+def all_providers() -> List[GenerationProvider]:
+    return list(_providers.values())
+
+
+def provider_stats() -> Dict[str, Dict[str, object]]:
+    return {provider.label: provider.stats.as_dict() for provider in _providers.values()}
+
+
+register_provider(ApiyiProvider())
+register_provider(CometProvider())
+# kitay.py — прежний клиент того же APIYI; отдельное имя — отдельная статистика
+register_provider(ApiyiProvider(name="kitay"))
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import logging
+from typing import Dict, Optional, Sequence
+
+from src.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Размеры результата от лучшего к самому быстрому
+IMAGE_SIZES = ("4K", "2K", "1K")
+
+
+class QualityController:
+    """
+    Выбор размера результата под нагрузку: пока очередь короткая и провайдер отвечает быстро —
+    4K; если ETA очереди или p95 задержки провайдера перешли порог — 2K, дальше — 1K.
+
+    Обратно к лучшему качеству — только когда нагрузка заметно спала (ниже порога × recover_ratio),
+    чтобы размер не прыгал туда-сюда на каждой задаче.
+    """
+
+    def __init__(
+        self,
+        eta_thresholds: Sequence[float],
+        p95_thresholds: Sequence[float],
+        recover_ratio: float,
+        enabled: bool = True,
+    ) -> None:
+        # пороги для перехода на IMAGE_SIZES[1], IMAGE_SIZES[2], ... (0 — не учитывать)
+        self.eta_thresholds = list(eta_thresholds)
+        self.p95_thresholds = list(p95_thresholds)
+        self.recover_ratio = recover_ratio
+        self.enabled = enabled
+
+        self.level = 0
+        self.chosen: Dict[str, int] = {}
+
+    def _pressure_level(self, eta_seconds: Optional[float], p95_seconds: Optional[float], ratio: float) -> int:
+        level = 0
+        for i, (eta_limit, p95_limit) in enumerate(zip(self.eta_thresholds, self.p95_thresholds), start=1):
+            over_eta = bool(eta_limit) and eta_seconds is not None and eta_seconds >= eta_limit * ratio
+            over_p95 = bool(p95_limit) and p95_seconds is not None and p95_seconds >= p95_limit * ratio
+            if over_eta or over_p95:
+                level = i
+        return min(level, len(IMAGE_SIZES) - 1)
+
+    def choose(self, eta_seconds: Optional[float], p95_seconds: Optional[float]) -> str:
+        """
+        Размер для очередной генерации по текущей ETA очереди и p95 задержки провайдера.
+        """
+        if not self.enabled:
+            return IMAGE_SIZES[0]
+
+        target = self._pressure_level(eta_seconds, p95_seconds, ratio=1.0)
+        if target < self.level:
+            target = max(target, self._pressure_level(eta_seconds, p95_seconds, ratio=self.recover_ratio))
+
+        if target != self.level:
+            logger.info(
+                "Размер результата: %s → %s (ETA очереди %s с, p95 провайдера %s с)",
+                IMAGE_SIZES[self.level],
+                IMAGE_SIZES[target],
+                eta_seconds,
+                p95_seconds,
+            )
+            self.level = target
+
+        size = IMAGE_SIZES[self.level]
+        self.chosen[size] = self.chosen.get(size, 0) + 1
+        return size
+
+    @property
+    def stats(self) -> Dict[str, object]:
+        return {
+            "current": IMAGE_SIZES[self.level],
+            "chosen": dict(self.chosen),
+        }
+
+
+quality_controller = QualityController(
+    eta_thresholds=[settings.GENERATION_SIZE_2K_ETA_SECONDS, settings.GENERATION_SIZE_1K_ETA_SECONDS],
+    p95_thresholds=[settings.GENERATION_SIZE_2K_P95_SECONDS, settings.GENERATION_SIZE_1K_P95_SECONDS],
+    recover_ratio=settings.GENERATION_SIZE_RECOVER_RATIO,
+    enabled=settings.GENERATION_ADAPTIVE_SIZE,
+)
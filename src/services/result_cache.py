@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from src.config import settings
+from src.services.output_store import StoredOutput, get_output_store
+
+
+def result_cache_key(
+    prompt_text: str,
+    model_name: str,
+    image_size: str,
+    aspect_ratio: str,
+    input_ids: Sequence[str],
+) -> str:
+    """
+    Стабильный ключ генерации: промпт, модель, размер/пропорции и входные фото
+    (по file_unique_id — он одинаковый, даже если то же фото прислали заново).
+    """
+    raw = json.dumps(
+        [prompt_text, model_name, image_size, aspect_ratio, list(input_ids)],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Кеш результатов генерации: ключ запроса -> sha256 картинки в output_store.
+    Сами файлы лежат в хранилище; если хранилище вытеснило файл — это промах.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._items: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[StoredOutput]:
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        digest, expires_at = item
+        output = get_output_store().get(digest) if expires_at >= time.monotonic() else None
+        if output is None:
+            self._items.pop(key, None)
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return output
+
+    def put(self, key: str, output: StoredOutput) -> None:
+        self._items[key] = (output.digest, time.monotonic() + self.ttl_seconds)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def forget(self, key: str) -> None:
+        self._items.pop(key, None)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+result_cache = ResultCache(
+    max_entries=settings.RESULT_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.RESULT_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+from src.config import settings
+from src.services.providers import ProviderError
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Момент (time.monotonic()), к которому задача генерации должна закончиться.
+# Ставит планировщик на время задачи; задачи, созданные внутри (single-flight, хеджирование), его наследуют.
+generation_deadline: ContextVar[Optional[float]] = ContextVar("generation_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[None]:
+    token = generation_deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        generation_deadline.reset(token)
+
+
+def deadline_remaining() -> Optional[float]:
+    """
+    Сколько секунд осталось до дедлайна текущей задачи (None — дедлайна нет).
+    """
+    deadline = generation_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After: число секунд или HTTP-дата.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """
+    Повторы с экспоненциальной задержкой и полным джиттером.
+
+    Повторяем только ошибки, которые могут пройти сами (ProviderError.retryable: 429, обрыв,
+    таймаут, 5xx, битый ответ). Retry-After провайдера соблюдаем. Повтор не начинаем,
+    если до дедлайна задачи не успеть подождать и выполнить ещё одну попытку.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        min_attempt_seconds: float,
+    ) -> None:
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_attempt_seconds = min_attempt_seconds
+
+        self.retries = 0
+        self.gave_up_deadline = 0
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            # раньше Retry-After нельзя; немного джиттера, чтобы все ждущие не пришли разом
+            delay = retry_after + random.uniform(0, self.base_delay)
+        return delay
+
+    async def run(self, factory: Callable[[], Awaitable[T]]) -> T:
+        attempt = 1
+        while True:
+            try:
+                return await factory()
+            except ProviderError as e:
+                if not e.retryable or attempt >= self.max_attempts:
+                    raise
+
+                delay = self.backoff(attempt, e.retry_after)
+                remaining = deadline_remaining()
+                if remaining is not None and delay + self.min_attempt_seconds > remaining:
+                    self.gave_up_deadline += 1
+                    logger.warning(
+                        "%s: не повторяем (%s) — до дедлайна %.0f с, нужно %.0f с",
+                        self.name,
+                        e.error_class,
+                        remaining,
+                        delay + self.min_attempt_seconds,
+                    )
+                    raise
+
+                self.retries += 1
+                logger.warning(
+                    "%s: попытка %s не удалась (%s), повтор через %.1f с",
+                    self.name,
+                    attempt,
+                    e.error_class,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "retries": self.retries,
+            "gave_up_deadline": self.gave_up_deadline,
+        }
+
+
+generation_retry = RetryPolicy(
+    name="generation",
+    max_attempts=settings.GENERATION_RETRY_MAX_ATTEMPTS,
+    base_delay=settings.GENERATION_RETRY_BASE_DELAY_SECONDS,
+    max_delay=settings.GENERATION_RETRY_MAX_DELAY_SECONDS,
+    min_attempt_seconds=settings.GENERATION_RETRY_MIN_ATTEMPT_SECONDS,
+)
@@ -0,0 +1,427 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from src.services.retry import deadline_scope
+from src.services.user_guard import UserGenerationGuard
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(RuntimeError):
+    """
+    Очередь генераций заполнена — заявку не принимаем.
+    """
+
+
+class AdmissionRejected(QueueFull):
+    """
+    Ожидаемое время готовности слишком большое — заявку не принимаем (до списания оплаты).
+    """
+
+
+@dataclass(frozen=True)
+class Admission:
+    """
+    Оценка для новой заявки: сколько задач перед ней и через сколько секунд она будет готова.
+    """
+
+    ahead: int
+    eta_seconds: float
+
+
+# Уровни пользователей для справедливой очереди (вес задаётся в settings.GENERATION_TIER_WEIGHTS)
+TIER_ADMIN = "admin"
+TIER_CREDITS = "credits"
+TIER_BALANCE = "balance"
+TIER_FREE = "free"
+
+# Сколько последних ожиданий храним на уровень для перцентилей
+WAIT_SAMPLES = 500
+
+# По скольким последним задачам оцениваем длительность одной генерации
+RUN_SAMPLES = 50
+
+
+@dataclass
+class _Entry:
+    job: Any
+    telegram_id: int
+    job_no: int
+    tier: str = TIER_FREE
+    weight: int = 1  # сколько генераций у провайдера (подборка стилей — по одной на стиль)
+    submitted_at: float = field(default_factory=time.monotonic)
+    queued_at: Optional[float] = None
+    done: Optional["asyncio.Future[None]"] = None
+
+
+class FairQueue:
+    """
+    Взвешенная справедливая очередь (stride scheduling).
+
+    - Между уровнями: уровень с весом 4 получает вчетверо больше запусков, чем уровень с весом 1,
+      но и уровень с малым весом не голодает.
+    - Внутри уровня: круговой обход по telegram_id — один пользователь не займёт все воркеры.
+    """
+
+    def __init__(self, weights: Dict[str, float]) -> None:
+        self.weights = weights
+
+        self._tiers: Dict[str, "OrderedDict[int, Deque[_Entry]]"] = {}
+        self._pass: Dict[str, float] = {}
+        self._vtime = 0.0
+        self._size = 0
+        self._available = asyncio.Semaphore(0)
+
+    def weight(self, tier: str) -> float:
+        return max(float(self.weights.get(tier, 1.0)), 0.001)
+
+    def qsize(self) -> int:
+        return self._size
+
+    def qsize_by_tier(self) -> Dict[str, int]:
+        return {
+            tier: sum(len(q) for q in users.values())
+            for tier, users in self._tiers.items()
+            if users
+        }
+
+    def put_nowait(self, entry: _Entry) -> None:
+        users = self._tiers.setdefault(entry.tier, OrderedDict())
+        if not users:
+            # уровень простаивал — не даём ему накопленного «кредита» очерёдности
+            self._pass[entry.tier] = max(self._pass.get(entry.tier, 0.0), self._vtime)
+        users.setdefault(entry.telegram_id, deque()).append(entry)
+        self._size += 1
+        self._available.release()
+
+    async def get(self) -> _Entry:
+        await self._available.acquire()
+
+        tier = min(
+            (t for t, users in self._tiers.items() if users),
+            key=lambda t: self._pass[t],
+        )
+        self._vtime = self._pass[tier]
+        self._pass[tier] += 1.0 / self.weight(tier)
+
+        users = self._tiers[tier]
+        telegram_id, entries = next(iter(users.items()))
+        entry = entries.popleft()
+        # пользователь уходит в конец круга своего уровня
+        del users[telegram_id]
+        if entries:
+            users[telegram_id] = entries
+
+        self._size -= 1
+        return entry
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+class GenerationScheduler:
+    """
+    Очередь генераций с фиксированным числом воркеров.
+
+    - submit() не ждёт генерацию: ставит заявку и сразу возвращает её позицию и ETA.
+    - Допуск: заявку не принимаем, если очередь заполнена или ETA (по медиане последних задач)
+      больше max_eta_seconds — это происходит до списания оплаты.
+    - Не больше одной генерации на пользователя (UserGenerationGuard): следующая заявка
+      того же пользователя ждёт своей очереди, не занимая воркер.
+    - Порядок запуска — FairQueue: веса уровней пользователей и круговой обход по telegram_id.
+    - Каждая задача ограничена job_timeout; по таймауту/ошибке вызывается on_error.
+    - run_job возвращает True, если задача действительно ходила к провайдеру: только такие
+      задачи (не кеш, не повторная доставка, не ошибка) идут в оценку длительности генерации.
+    """
+
+    def __init__(
+        self,
+        run_job: Callable[[Any], Awaitable[Optional[bool]]],
+        on_error: Callable[[Any, BaseException], Awaitable[None]],
+        guard: UserGenerationGuard,
+        workers: int,
+        max_queue: int,
+        job_timeout: float,
+        tier_weights: Optional[Dict[str, float]] = None,
+        max_eta_seconds: float = 0,
+        default_job_seconds: float = 30,
+        min_job_samples: int = 5,
+    ) -> None:
+        self.run_job = run_job
+        self.on_error = on_error
+        self.guard = guard
+        self.workers = workers
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.max_eta_seconds = max_eta_seconds
+        self.default_job_seconds = default_job_seconds
+        self.min_job_samples = max(1, min_job_samples)
+
+        self._queue = FairQueue(tier_weights or {})
+        self._workers: List[asyncio.Task] = []
+        self._admissions: set = set()
+        self._numbers = itertools.count(1)
+
+        # в генерациях, а не в заявках: подборка из N стилей весит N
+        self.pending = 0  # принято, но ещё не запущено (ждут воркер или предыдущую заявку пользователя)
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.rejected_eta = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._waits_by_tier: Dict[str, Deque[float]] = {}
+        self._run_times: Deque[float] = deque(maxlen=RUN_SAMPLES)
+        # заявки, ждущие слот своего пользователя (UserGenerationGuard): новая заявка их вытеснит
+        self._held_by_user: Dict[int, int] = {}
+
+    @property
+    def is_started(self) -> bool:
+        return bool(self._workers)
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"generation-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info("Планировщик генераций: %s воркеров, очередь до %s", self.workers, self.max_queue)
+
+    async def stop(self) -> None:
+        tasks = self._workers + list(self._admissions)
+        self._workers = []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ---------- допуск ----------
+
+    def job_seconds_estimate(self) -> float:
+        """
+        Типичная длительность одной генерации: медиана последних RUN_SAMPLES;
+        пока замеров меньше min_job_samples — значение по умолчанию.
+        """
+        if len(self._run_times) < self.min_job_samples:
+            return self.default_job_seconds
+        ordered = sorted(self._run_times)
+        return ordered[len(ordered) // 2]
+
+    def estimate(self, telegram_id: Optional[int] = None) -> Admission:
+        """
+        Оценка для заявки, поставленной прямо сейчас: если свободный воркер есть — только сама
+        генерация; если заняты все — ещё ожидание, пока воркеры разберут очередь и запущенные
+        задачи (те в среднем выполнены наполовину).
+
+        Заявка самого пользователя (telegram_id), ждущая его слот, впереди не считается:
+        новая её заменит (или будет отклонена, см. UserGenerationGuard).
+        Очередь и запущенное считаются в генерациях (см. _Entry.weight).
+        """
+        job_seconds = self.job_seconds_estimate()
+        pending = self.pending
+        if telegram_id is not None:
+            pending -= self._held_by_user.get(telegram_id, 0)
+        ahead = pending + self.running
+
+        workers = max(self.workers, 1)
+        wait = 0.0
+        if ahead >= workers:
+            wait = (pending + 0.5 * self.running) / workers * job_seconds
+        return Admission(ahead=ahead, eta_seconds=round(wait + job_seconds, 1))
+
+    def check_admission(self, telegram_id: Optional[int] = None, weight: int = 1) -> Admission:
+        """
+        Решает, принимать ли новую заявку из weight генераций. QueueFull — очередь заполнена,
+        AdmissionRejected — ожидание больше max_eta_seconds (0 — без ограничения).
+        """
+        if self._queue_full(weight):
+            self.rejected += 1
+            raise QueueFull(
+                "Сейчас очень много желающих сделать фотосессию 🙈\n"
+                "Попробуй, пожалуйста, через пару минут."
+            )
+
+        admission = self.estimate(telegram_id)
+        if self.max_eta_seconds and admission.eta_seconds > self.max_eta_seconds:
+            self.rejected_eta += 1
+            raise AdmissionRejected(
+                "Сервис генерации сейчас перегружен — ждать пришлось бы слишком долго 🙈\n"
+                "Оплату не списали. Попробуй, пожалуйста, через несколько минут."
+            )
+        return admission
+
+    def _queue_full(self, weight: int) -> bool:
+        if self.pending >= self.max_queue:
+            return True
+        # заявку тяжелее всей очереди всё же берём, когда очередь пуста — иначе она не пройдёт никогда
+        return self.pending > 0 and self.pending + weight > self.max_queue
+
+    # ---------- постановка ----------
+
+    def submit(
+        self,
+        job: Any,
+        telegram_id: int,
+        tier: str = TIER_FREE,
+        admit: bool = True,
+        weight: int = 1,
+    ) -> Admission:
+        """
+        Ставит задачу в очередь с уровнем tier. Возвращает оценку (позиция и ETA).
+        admit=True — сначала check_admission(); admit=False — только жёсткий лимит очереди
+        (для задач, которые уже оплачены, например после перезапуска).
+        weight — сколько генераций у провайдера делает задача (подборка — по одной на стиль).
+        """
+        weight = max(1, weight)
+        if admit:
+            admission = self.check_admission(telegram_id, weight)
+        elif self._queue_full(weight):
+            self.rejected += 1
+            raise QueueFull("Очередь генераций заполнена")
+        else:
+            admission = self.estimate(telegram_id)
+
+        self.start()
+
+        entry = _Entry(job=job, telegram_id=telegram_id, job_no=next(self._numbers), tier=tier, weight=weight)
+        self.pending += weight
+        self._held_by_user[telegram_id] = self._held_by_user.get(telegram_id, 0) + weight
+        self.submitted += 1
+
+        task = asyncio.create_task(self._admit(entry))
+        self._admissions.add(task)
+        task.add_done_callback(self._admissions.discard)
+        return admission
+
+    async def _admit(self, entry: _Entry) -> None:
+        started = False
+        try:
+            # слот пользователя держим, пока задача не выполнена воркером
+            async with self.guard.hold(entry.telegram_id):
+                self._release_held(entry)
+                entry.done = asyncio.get_running_loop().create_future()
+                entry.queued_at = time.monotonic()
+                started = True
+                self._queue.put_nowait(entry)
+                await entry.done
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # GenerationReplaced / GenerationInProgress — до запуска дело не дошло
+            if not started:
+                self.pending -= entry.weight
+                self._release_held(entry)
+            await self._safe_on_error(entry, e)
+
+    def _release_held(self, entry: _Entry) -> None:
+        left = self._held_by_user.get(entry.telegram_id, 0) - entry.weight
+        if left > 0:
+            self._held_by_user[entry.telegram_id] = left
+        else:
+            self._held_by_user.pop(entry.telegram_id, None)
+
+    # ---------- выполнение ----------
+
+    async def _worker(self, worker_no: int) -> None:
+        while True:
+            entry = await self._queue.get()
+            self.pending -= entry.weight
+            self.running += entry.weight
+
+            waited = time.monotonic() - entry.submitted_at
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._waits_by_tier.setdefault(entry.tier, deque(maxlen=WAIT_SAMPLES)).append(waited)
+
+            started_at = time.monotonic()
+            generated = False
+            try:
+                # дедлайн виден внутри задачи: повторы запросов к провайдеру в него укладываются
+                with deadline_scope(self.job_timeout):
+                    generated = bool(await asyncio.wait_for(self.run_job(entry.job), timeout=self.job_timeout))
+                self.completed += 1
+            except asyncio.TimeoutError as e:
+                self.timed_out += 1
+                logger.error("Задача генерации #%s превысила %s с", entry.job_no, self.job_timeout)
+                await self._safe_on_error(entry, e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.exception("Задача генерации #%s упала: %s", entry.job_no, e)
+                await self._safe_on_error(entry, e)
+            finally:
+                self.running -= entry.weight
+                run_time = time.monotonic() - started_at
+                self._run_total += run_time
+                if generated:
+                    self._run_times.append(run_time)
+                if entry.done is not None and not entry.done.done():
+                    entry.done.set_result(None)
+
+    async def _safe_on_error(self, entry: _Entry, exc: BaseException) -> None:
+        try:
+            await self.on_error(entry.job, exc)
+        except Exception as e:
+            logger.warning("Не удалось сообщить об ошибке задачи #%s: %s", entry.job_no, e)
+
+    # ---------- метрики ----------
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        started = self.completed + self.failed + self.timed_out + self.running
+        finished = self.completed + self.failed + self.timed_out
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "pending": self.pending,
+            "running": self.running,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "rejected_eta": self.rejected_eta,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "wait_avg_seconds": round(self._wait_total / started, 3) if started else 0.0,
+            "wait_max_seconds": round(self._wait_max, 3),
+            "run_avg_seconds": round(self._run_total / finished, 3) if finished else 0.0,
+            "job_seconds_estimate": round(self.job_seconds_estimate(), 3),
+            "eta_seconds": self.estimate().eta_seconds,
+        }
+
+    @property
+    def tier_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Ожидание в очереди по уровням (по последним WAIT_SAMPLES запускам) — для подбора весов.
+        """
+        queued = self._queue.qsize_by_tier()
+        result: Dict[str, Dict[str, float]] = {}
+        for tier in sorted(set(self._waits_by_tier) | set(queued)):
+            samples = list(self._waits_by_tier.get(tier, ()))
+            result[tier] = {
+                "weight": self._queue.weight(tier),
+                "queued": queued.get(tier, 0),
+                "started": len(samples),
+                "wait_p50_seconds": _percentile(samples, 0.5),
+                "wait_p90_seconds": _percentile(samples, 0.9),
+                "wait_p99_seconds": _percentile(samples, 0.99),
+            }
+        return result
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Generic, TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Flight(Generic[T]):
+    def __init__(self, task: "asyncio.Task[T]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Склейка одинаковых одновременных вызовов: пока работа по ключу выполняется,
+    следующие вызовы с тем же ключом не запускают её заново, а ждут тот же результат.
+
+    Работа идёт в отдельной задаче, а не в корутине первого вызвавшего:
+    если его отменили (пользователь ушёл, таймаут хендлера) — остальные дождутся результата.
+    Задача отменяется, только когда её больше никто не ждёт.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._flights: Dict[str, _Flight[T]] = {}
+
+        self.started = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.create_task(factory())
+            flight = _Flight(task)
+            self._flights[key] = flight
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+            self.started += 1
+        else:
+            self.coalesced += 1
+            logger.info("%s: присоединились к уже идущему вызову (%s)", self.name, key[:12])
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # никто больше не ждёт — незачем продолжать
+                self.abandoned += 1
+                flight.task.cancel()
+
+    def _forget(self, key: str, task: "asyncio.Task[T]") -> None:
+        flight = self._flights.get(key)
+        if flight is not None and flight.task is task:
+            del self._flights[key]
+        if not task.cancelled():
+            # исключение получают ждущие через shield; помечаем его прочитанным,
+            # чтобы не было «Task exception was never retrieved»
+            task.exception()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
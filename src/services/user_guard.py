@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+from src.config import settings
+
+
+# Что делать с новой генерацией, пока у пользователя идёт предыдущая
+POLICY_REPLACE = "replace"  # встать в очередь; более новая заявка вытесняет ждущую
+POLICY_REJECT = "reject"  # сразу отказать
+
+
+class GenerationInProgress(RuntimeError):
+    """
+    У пользователя уже идёт генерация (политика reject).
+    """
+
+
+class GenerationReplaced(RuntimeError):
+    """
+    Ждущую заявку вытеснила более новая от того же пользователя (политика replace).
+    """
+
+
+class UserGenerationGuard:
+    """
+    Не больше одной активной генерации на пользователя.
+
+    Блокировки хранятся в WeakValueDictionary: пока кто-то держит или ждёт блокировку
+    пользователя — она жива, потом запись исчезает сама, реестр не растёт.
+    """
+
+    def __init__(self, policy: str) -> None:
+        self.policy = policy
+
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._latest: Dict[int, int] = {}
+        self._tickets = itertools.count(1)
+
+        self.rejected = 0
+        self.replaced = 0
+
+    def _lock_for(self, telegram_id: int) -> asyncio.Lock:
+        lock = self._locks.get(telegram_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[telegram_id] = lock
+        return lock
+
+    def is_busy(self, telegram_id: int) -> bool:
+        lock = self._locks.get(telegram_id)
+        return lock is not None and lock.locked()
+
+    @asynccontextmanager
+    async def hold(self, telegram_id: int) -> AsyncIterator[None]:
+        """
+        Держит «слот» пользователя на время генерации.
+        reject: GenerationInProgress, если слот занят.
+        replace: ждёт освобождения; если за это время пришла новая заявка — GenerationReplaced.
+        """
+        lock = self._lock_for(telegram_id)
+
+        if lock.locked() and self.policy == POLICY_REJECT:
+            self.rejected += 1
+            raise GenerationInProgress(
+                "Я ещё готовлю твою предыдущую фотосессию ⏳\n"
+                "Пришли новое фото, когда она будет готова."
+            )
+
+        ticket = next(self._tickets)
+        self._latest[telegram_id] = ticket
+
+        async with lock:
+            if self._latest.get(telegram_id) != ticket:
+                self.replaced += 1
+                raise GenerationReplaced(
+                    "Ты прислал(а) более новое фото — сделаю фотосессию по нему 👌"
+                )
+            try:
+                yield
+            finally:
+                if self._latest.get(telegram_id) == ticket:
+                    del self._latest[telegram_id]
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active_users": sum(1 for lock in self._locks.values() if lock.locked()),
+            "rejected": self.rejected,
+            "replaced": self.replaced,
+        }
+
+
+user_generation_guard = UserGenerationGuard(policy=settings.USER_GENERATION_POLICY)